@@ -1,13 +1,22 @@
+import atexit
+from time import monotonic, perf_counter_ns
+
 import bpy
 from bpy.app.handlers import persistent
 
 from .wakatime_blender import settings
+from .wakatime_blender.activity import gate
+from .wakatime_blender.category import BUILDING, DEBUGGING, categories
 from .wakatime_blender.heartbeat_queue import HeartbeatQueue
-from .wakatime_blender.log import ERROR, INFO, log
+from .wakatime_blender.log import ERROR, INFO, LogDialog, log
 from .wakatime_blender.preferences import (
     PreferencesDialog,
     WakatimeProjectProperties,
 )
+from .wakatime_blender.rollups import ReportDialog
+from .wakatime_blender.sessions import PLAYBACK, RENDER
+from .wakatime_blender.stats import ExportStats, StatsDialog, stats
+from .wakatime_blender.trace import ToggleTraceRecording, stop_recording
 from .wakatime_blender.wakatime_downloader import (
     ForceWakatimeDownload,
     WakatimeDownloader,
@@ -29,18 +38,67 @@ __version__ = ".".join((f"{n}" for n in bl_info["version"]))
 heartbeat_queue: HeartbeatQueue
 
 REGISTERED = False
+# the worker threads are started after the first load_post or activity event,
+# so that the add-on does not slow down Blender startup
+WORKERS_SCHEDULED = False
+
+
+def start_workers():
+    if not REGISTERED:
+        return None
+    try:
+        WakatimeDownloader().start()
+        heartbeat_queue.start()
+    except Exception as e:
+        log(ERROR, "Unable to start worker threads: {}", e)
+    # do not repeat the timer
+    return None
+
+
+def schedule_workers():
+    global WORKERS_SCHEDULED
+    WORKERS_SCHEDULED = True
+    if bpy.app.background:
+        # timers are not run without the UI event loop
+        start_workers()
+    else:
+        bpy.app.timers.register(start_workers, first_interval=0)
+
+
+def stop_workers():
+    """Flush the heartbeats and the config within the shutdown deadline.
+
+    Runs on unregister, or at exit if Blender quits without unregistering."""
+    atexit.unregister(stop_workers)
+    if bpy.app.timers.is_registered(start_workers):
+        bpy.app.timers.unregister(start_workers)
+    heartbeat_queue.stop()
+    settings.save()
 
 
 def handle_activity(is_write=False):
     if not REGISTERED:
         return
+    if not WORKERS_SCHEDULED:
+        schedule_workers()
+    start = perf_counter_ns()
     heartbeat_queue.enqueue(bpy.data.filepath, is_write)
     if not settings.api_key():
         PreferencesDialog.show()
+    stats.activity_calls += 1
+    stats.activity_ns += perf_counter_ns() - start
 
 
 @persistent
 def load_handler(_):
+    WakatimeProjectProperties.refresh_snapshot()
+    # loading a file drops the msgbus subscriptions
+    categories.subscribe()
+    if REGISTERED:
+        # playback does not survive loading a file
+        heartbeat_queue.finish_sessions()
+        categories.set_playing(False)
+        heartbeat_queue.index_libraries()
     handle_activity()
 
 
@@ -51,16 +109,74 @@ def save_handler(_):
 
 @persistent
 def activity_handler(_):
+    # this runs for every depsgraph update, so unless a heartbeat is due
+    # it should return after a couple of attribute reads
+    gate.events += 1
+    if not gate.dirty and monotonic() < gate.deadline:
+        return
     handle_activity()
 
 
+def start_session(kind, category):
+    # closes the activity gate until the session finishes, so it has
+    # to be called before the category is changed
+    if not REGISTERED:
+        return
+    if not WORKERS_SCHEDULED:
+        schedule_workers()
+    heartbeat_queue.start_session(kind, bpy.data.filepath, category)
+
+
+def finish_session(kind):
+    if REGISTERED:
+        heartbeat_queue.finish_session(kind)
+
+
+@persistent
+def render_init_handler(*_):
+    start_session(RENDER, BUILDING)
+    categories.set_rendering(True)
+
+
+@persistent
+def render_done_handler(*_):
+    finish_session(RENDER)
+    categories.set_rendering(False)
+
+
+@persistent
+def playback_start_handler(*_):
+    start_session(PLAYBACK, DEBUGGING)
+    categories.set_playing(True)
+
+
+@persistent
+def playback_stop_handler(*_):
+    finish_session(PLAYBACK)
+    categories.set_playing(False)
+
+
+# handlers that only exist in some Blender versions are skipped
+SESSION_HANDLERS = (
+    ("render_init", render_init_handler),
+    ("render_complete", render_done_handler),
+    ("render_cancel", render_done_handler),
+    ("animation_playback_pre", playback_start_handler),
+    ("animation_playback_post", playback_stop_handler),
+)
+
+
 def menu(self, _context):
     self.layout.operator(PreferencesDialog.bl_idname)
+    self.layout.operator(ReportDialog.bl_idname)
     self.layout.operator(ForceWakatimeDownload.bl_idname)
+    self.layout.operator(StatsDialog.bl_idname)
+    self.layout.operator(LogDialog.bl_idname)
+    self.layout.operator(ToggleTraceRecording.bl_idname)
 
 
 def register():
-    global REGISTERED, heartbeat_queue
+    global REGISTERED, WORKERS_SCHEDULED, heartbeat_queue
     if REGISTERED:
         return
     try:
@@ -69,17 +185,24 @@ def register():
         bpy.utils.register_class(ForceWakatimeDownload)
         bpy.utils.register_class(WakatimeProjectProperties)
         bpy.utils.register_class(PreferencesDialog)
+        bpy.utils.register_class(ExportStats)
+        bpy.utils.register_class(StatsDialog)
+        bpy.utils.register_class(LogDialog)
+        bpy.utils.register_class(ToggleTraceRecording)
+        bpy.utils.register_class(ReportDialog)
+        WakatimeProjectProperties.refresh_snapshot()
         bpy.types.TOPBAR_MT_app_system.append(menu)
         bpy.app.handlers.load_post.append(load_handler)
         bpy.app.handlers.save_post.append(save_handler)
         bpy.app.handlers.depsgraph_update_pre.append(activity_handler)
-        try:
-            downloader = WakatimeDownloader()
-            heartbeat_queue = HeartbeatQueue(__version__)
-            downloader.start()
-            heartbeat_queue.start()
-        except Exception as e:
-            log(ERROR, "Unable to start worker threads: {}", e)
+        for name, handler in SESSION_HANDLERS:
+            handlers = getattr(bpy.app.handlers, name, None)
+            if handlers is not None:
+                handlers.append(handler)
+        categories.subscribe()
+        heartbeat_queue = HeartbeatQueue(__version__)
+        WORKERS_SCHEDULED = False
+        atexit.register(stop_workers)
     finally:
         REGISTERED = True
 
@@ -94,10 +217,20 @@ def unregister():
         bpy.app.handlers.load_post.remove(load_handler)
         bpy.app.handlers.save_post.remove(save_handler)
         bpy.app.handlers.depsgraph_update_pre.remove(activity_handler)
+        for name, handler in SESSION_HANDLERS:
+            handlers = getattr(bpy.app.handlers, name, None)
+            if handlers is not None and handler in handlers:
+                handlers.remove(handler)
+        categories.unsubscribe()
         bpy.utils.unregister_class(ForceWakatimeDownload)
         bpy.utils.unregister_class(PreferencesDialog)
-        heartbeat_queue.shutdown()
-        heartbeat_queue.join(heartbeat_queue.POLL_INTERVAL * 3)
+        bpy.utils.unregister_class(ExportStats)
+        bpy.utils.unregister_class(StatsDialog)
+        bpy.utils.unregister_class(LogDialog)
+        bpy.utils.unregister_class(ToggleTraceRecording)
+        bpy.utils.unregister_class(ReportDialog)
+        stop_recording()
+        stop_workers()
         # unregister preferences only after the heartbeat queue has stopped
         bpy.utils.unregister_class(WakatimeProjectProperties)
     finally:
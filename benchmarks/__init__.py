@@ -0,0 +1,75 @@
+"""Benchmarks of the add-on running against a fake bpy.
+
+Run from the repository root::
+
+    python -m benchmarks [--output results.json] [benchmark ...]
+
+Results are printed, and optionally written, as JSON, so that they can
+be compared between releases.
+"""
+import contextlib
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+from types import ModuleType
+from typing import Any, Dict
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_NAME = "wakatime_addon"
+FAKE_CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_client.py")
+
+
+def load_addon(home: str = "") -> ModuleType:
+    """Import the add-on package with the fake bpy and a throwaway home directory.
+
+    The fake client is installed in place of the wakatime client,
+    so that registering the add-on does not download anything.
+    """
+    if ADDON_NAME in sys.modules:
+        return sys.modules[ADDON_NAME]
+    home = home or tempfile.mkdtemp(prefix="wakatime-bench-")
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home
+    from . import fake_bpy
+
+    fake_bpy.install()
+    spec = importlib.util.spec_from_file_location(
+        ADDON_NAME,
+        os.path.join(ADDON_DIR, "__init__.py"),
+        submodule_search_locations=[ADDON_DIR],
+    )
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[ADDON_NAME] = addon
+    spec.loader.exec_module(addon)
+    settings = addon.settings
+    os.makedirs(os.path.dirname(settings.API_CLIENT), exist_ok=True)
+    shutil.copy(FAKE_CLIENT, settings.API_CLIENT)
+    return addon
+
+
+def addon_module(name: str) -> ModuleType:
+    """One of the wakatime_blender modules of the loaded add-on"""
+    return sys.modules[f"{ADDON_NAME}.wakatime_blender.{name}"]
+
+
+def fake_client_log(addon: ModuleType) -> str:
+    client = addon.settings.api_client()
+    return os.path.join(os.path.dirname(client), "fake-client.jsonl")
+
+
+def write_config(addon: ModuleType, **options: Any) -> None:
+    settings = addon.settings
+    for option, value in options.items():
+        settings.set(option, str(value))
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the add-on's log output while measuring"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def result(name: str, value: float, unit: str, **params: Any) -> Dict[str, Any]:
+    return {"name": name, "value": value, "unit": unit, "params": params}
@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import platform
+import sys
+
+from . import (
+    daemon,
+    download,
+    fake_client_log,
+    load_addon,
+    pipeline,
+    quiet,
+    replay,
+    startup,
+    transport,
+)
+
+BENCHMARKS = {
+    **startup.BENCHMARKS,
+    **pipeline.BENCHMARKS,
+    **transport.BENCHMARKS,
+    **daemon.BENCHMARKS,
+    **replay.BENCHMARKS,
+    **download.BENCHMARKS,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks).difference(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    addon = load_addon()
+    # the worker threads log to stdout in between the benchmarks as well
+    with quiet():
+        addon.register()
+        try:
+            results = []
+            for name, benchmark in BENCHMARKS.items():
+                if not args.benchmarks or name in args.benchmarks:
+                    results.extend(benchmark(addon))
+        finally:
+            addon.unregister()
+            if os.path.exists(fake_client_log(addon)):
+                os.remove(fake_client_log(addon))
+    report = {
+        "version": addon.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Several Blender instances sending through the shared sender daemon."""
+import os
+import subprocess
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Dict, List
+
+from . import addon_module, quiet, result, write_config
+from .pipeline import _client_calls
+
+INSTANCES = (1, 4, 16)
+SENDS_PER_INSTANCE = 20
+# the daemon exits soon after the benchmark
+IDLE_TIMEOUT = 1
+
+
+def _instance(
+    heartbeat_queue: ModuleType, index: int, latencies: List[float], barrier
+) -> None:
+    sender = heartbeat_queue.SenderDaemonClient()
+    barrier.wait()
+    try:
+        for i in range(SENDS_PER_INSTANCE):
+            heartbeat = heartbeat_queue.HeartBeat(
+                f"/projects/farm/node_{index:02d}.blend", "farm", time.time() + i
+            )
+            start = time.perf_counter()
+            sender.send([heartbeat], "blender/2.93.0", False, False)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        sender.close()
+
+
+def bench_sender_daemon(addon: ModuleType) -> List[Dict]:
+    """Latency of a send and the number of client calls made by the daemon"""
+    heartbeat_queue = addon_module("heartbeat_queue")
+    write_config(addon, api_key="00000000-0000-0000-0000-000000000000")
+    daemon = subprocess.Popen(
+        [
+            sys.executable,
+            heartbeat_queue.SenderDaemonClient.DAEMON,
+            addon.settings.SENDER_SOCKET,
+            str(IDLE_TIMEOUT),
+        ]
+    )
+    results = []
+    try:
+        # otherwise the first instance would start a daemon of its own
+        while not os.path.exists(addon.settings.SENDER_SOCKET):
+            if daemon.poll() is not None:
+                raise RuntimeError("The sender daemon exited")
+            time.sleep(0.01)
+        for instances in INSTANCES:
+            latencies: List[float] = []
+            calls = _client_calls(addon)
+            barrier = threading.Barrier(instances)
+            threads = [
+                threading.Thread(
+                    target=_instance,
+                    args=(heartbeat_queue, index, latencies, barrier),
+                )
+                for index in range(instances)
+            ]
+            with quiet():
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            latencies.sort()
+            results.append(
+                result(
+                    "sender_daemon",
+                    latencies[len(latencies) // 2],
+                    "ms",
+                    stat="p50",
+                    instances=instances,
+                    sends=len(latencies),
+                    client_calls=_client_calls(addon) - calls,
+                )
+            )
+    finally:
+        daemon.wait(IDLE_TIMEOUT + 10)
+    return results
+
+
+BENCHMARKS = {"sender_daemon": bench_sender_daemon}
@@ -0,0 +1,131 @@
+"""Client download against a local stand-in for API_CLIENT_URL."""
+import contextlib
+import io
+import os
+import re
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+from typing import Dict, Iterator, List
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from . import FAKE_CLIENT, addon_module, quiet, result
+
+# the part of the repository archive that is not needed by the add-on
+PADDING_SIZE = 4 * 1024 * 1024
+
+
+def make_archive() -> bytes:
+    """A zip laid out like the legacy client repository archive"""
+    data = io.BytesIO()
+    with ZipFile(data, "w", ZIP_DEFLATED) as zf:
+        root = "legacy-python-cli-master"
+        with open(FAKE_CLIENT) as inp:
+            zf.writestr(f"{root}/wakatime/cli.py", inp.read())
+        zf.writestr(f"{root}/wakatime/__init__.py", "")
+        zf.writestr(f"{root}/README.md", "legacy wakatime client\n")
+        zf.writestr(f"{root}/tests/samples/blob.bin", os.urandom(PADDING_SIZE))
+    return data.getvalue()
+
+
+class ArchiveServer(ThreadingHTTPServer):
+    """Serves the archive with Range support.
+
+    The first response is cut off after cut_after bytes,
+    like a dropped connection would do."""
+
+    def __init__(self, archive: bytes, cut_after: int) -> None:
+        super().__init__(("127.0.0.1", 0), _ArchiveHandler)
+        self.archive = archive
+        self.cut_after = cut_after
+        self.requests: List[Dict] = []
+        self.bytes_sent = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/master.zip"
+
+
+class _ArchiveHandler(BaseHTTPRequestHandler):
+    server: ArchiveServer
+
+    def do_GET(self):
+        archive = self.server.archive
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= len(archive):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(archive) - 1}/{len(archive)}"
+            )
+        else:
+            self.send_response(200)
+        self.server.requests.append({"range": self.headers.get("Range")})
+        body = archive[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.cut_after:
+            body = body[: self.server.cut_after]
+            self.server.cut_after = 0
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_archive(archive: bytes, cut_after: int = 0) -> Iterator[ArchiveServer]:
+    server = ArchiveServer(archive, cut_after)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_download(addon: ModuleType) -> List[Dict]:
+    """Interrupted download, resumed with a Range request, then installation"""
+    downloader = addon_module("wakatime_downloader")
+    archive = make_archive()
+    with serve_archive(archive, cut_after=len(archive) // 2) as server, quiet():
+        start = time.perf_counter()
+        try:
+            downloader.WakatimeDownloader(force=True, url=server.url).run()
+        except urllib.error.URLError:
+            pass
+        downloader.WakatimeDownloader(force=True, url=server.url).run()
+        elapsed = time.perf_counter() - start
+    settings = addon.settings
+    runtime_dir = os.path.join(
+        settings.API_CLIENT_VERSIONS_DIR, settings.active_api_client_version()
+    )
+    extracted = [
+        os.path.relpath(os.path.join(root, name), runtime_dir)
+        for root, _dirs, files in os.walk(runtime_dir)
+        for name in files
+    ]
+    return [
+        result(
+            "download",
+            elapsed * 1000,
+            "ms",
+            archive_bytes=len(archive),
+            bytes_sent=server.bytes_sent,
+            requests=server.requests,
+            extracted=sorted(extracted),
+        )
+    ]
+
+
+BENCHMARKS = {"download": bench_download}
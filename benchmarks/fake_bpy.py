@@ -0,0 +1,199 @@
+"""Minimal stand-in for the parts of bpy used by the add-on.
+
+It is only good enough to register the add-on and drive its handlers
+outside of Blender, which is all the benchmarks need.
+"""
+import os
+import sys
+import types
+from typing import Any, Dict, List
+
+
+def _property(**keywords) -> tuple:
+    # Blender 2.93 represents deferred properties as (function, keywords)
+    return _property, keywords
+
+
+class _Pointer:
+    def __init__(self, group_type: type) -> None:
+        self._type = group_type
+        self._name = ""
+
+    def __set_name__(self, _owner, name: str) -> None:
+        self._name = name
+
+    def __get__(self, instance, _owner=None):
+        if instance is None:
+            return self
+        groups = instance.__dict__.setdefault("_pointers", {})
+        group = groups.get(self._type)
+        if group is None:
+            group = groups[self._type] = self._type.__new__(self._type)
+            group._init_defaults()
+        return group
+
+
+def PointerProperty(type: type, **_keywords) -> _Pointer:
+    return _Pointer(type)
+
+
+class PropertyGroup:
+    def _init_defaults(self) -> None:
+        for name, annotation in getattr(type(self), "__annotations__", {}).items():
+            if isinstance(annotation, tuple):
+                object.__setattr__(self, name, annotation[1].get("default"))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        annotation = getattr(type(self), "__annotations__", {}).get(name)
+        if isinstance(annotation, tuple) and annotation[1].get("update"):
+            annotation[1]["update"](self, context)
+
+
+class Operator:
+    bl_idname = ""
+
+    def report(self, _type: set, _message: str) -> None:
+        pass
+
+
+class World:
+    pass
+
+
+class Window:
+    pass
+
+
+class Area:
+    pass
+
+
+class _MsgBus:
+    def __init__(self) -> None:
+        self.subscriptions: Dict[object, List] = {}
+
+    def subscribe_rna(self, key, owner, args, notify, **_keywords) -> None:
+        self.subscriptions.setdefault(owner, []).append((key, args, notify))
+
+    def clear_by_owner(self, owner) -> None:
+        self.subscriptions.pop(owner, None)
+
+
+class Menu:
+    def __init__(self) -> None:
+        self.draw_funcs: List = []
+
+    def append(self, func) -> None:
+        self.draw_funcs.append(func)
+
+    def remove(self, func) -> None:
+        self.draw_funcs.remove(func)
+
+
+def persistent(func):
+    return func
+
+
+class _Handlers(types.SimpleNamespace):
+    persistent = staticmethod(persistent)
+
+
+def register_class(cls: type) -> None:
+    register = cls.__dict__.get("register")
+    if register is not None:
+        register.__get__(None, cls)()
+
+
+def unregister_class(_cls: type) -> None:
+    pass
+
+
+class _Timers:
+    """Runs the timer functions right away, there is no event loop to wait for"""
+
+    def register(self, func, first_interval: float = 0, persistent=False) -> None:
+        func()
+
+    def is_registered(self, _func) -> bool:
+        return False
+
+    def unregister(self, _func) -> None:
+        pass
+
+
+def _abspath(path: str, start=None, library=None) -> str:
+    """Resolves "//" relative to the file, or to the library linking it"""
+    if not path.startswith("//"):
+        return path
+    if library is not None:
+        start = os.path.dirname(_abspath(library.filepath, library=library.parent))
+    elif start is None:
+        start = os.path.dirname(bpy.data.filepath)
+    return os.path.join(start, path[2:])
+
+
+class _Operators:
+    def __getattr__(self, _name: str):
+        return self
+
+    def __call__(self, *_args, **_kwargs) -> set:
+        return {"FINISHED"}
+
+
+bpy = types.ModuleType("bpy")
+bpy.app = types.ModuleType("bpy.app")
+bpy.app.version_string = "2.93.0"
+bpy.app.background = False
+bpy.app.handlers = _Handlers(
+    load_post=[],
+    save_post=[],
+    depsgraph_update_pre=[],
+    render_init=[],
+    render_complete=[],
+    render_cancel=[],
+    animation_playback_pre=[],
+    animation_playback_post=[],
+)
+bpy.app.timers = _Timers()
+bpy.props = types.ModuleType("bpy.props")
+for _name in ("BoolProperty", "FloatProperty", "IntProperty", "StringProperty"):
+    setattr(bpy.props, _name, _property)
+bpy.props.PointerProperty = PointerProperty
+bpy.types = types.ModuleType("bpy.types")
+bpy.types.Operator = Operator
+bpy.types.PropertyGroup = PropertyGroup
+bpy.types.World = World
+bpy.types.Window = Window
+bpy.types.Area = Area
+bpy.types.TOPBAR_MT_app_system = Menu()
+bpy.utils = types.ModuleType("bpy.utils")
+bpy.utils.register_class = register_class
+bpy.utils.unregister_class = unregister_class
+bpy.ops = _Operators()
+bpy.msgbus = _MsgBus()
+bpy.path = types.ModuleType("bpy.path")
+bpy.path.abspath = _abspath
+bpy.data = types.SimpleNamespace(filepath="", worlds=[World()], libraries=[])
+context = types.SimpleNamespace(blend_data=bpy.data, screen=None, selected_objects=[])
+bpy.context = context
+
+bpy_types = types.ModuleType("bpy_types")
+bpy_types.PropertyGroup = PropertyGroup
+
+
+def install() -> types.ModuleType:
+    """Put the fake bpy into sys.modules and return it."""
+    modules: Dict[str, types.ModuleType] = {
+        "bpy": bpy,
+        "bpy.app": bpy.app,
+        "bpy.app.handlers": bpy.app.handlers,
+        "bpy.app.timers": bpy.app.timers,
+        "bpy.path": bpy.path,
+        "bpy.props": bpy.props,
+        "bpy.types": bpy.types,
+        "bpy.utils": bpy.utils,
+        "bpy_types": bpy_types,
+    }
+    sys.modules.update(modules)
+    return bpy
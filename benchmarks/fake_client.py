@@ -0,0 +1,29 @@
+"""Stand-in for the legacy wakatime client's cli.py.
+
+It records every call as a JSON line in fake-client.jsonl next to itself
+and reports success, so that the benchmarks can see what was sent.
+"""
+import json
+import os
+import sys
+import time
+
+LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake-client.jsonl")
+
+
+def execute(argv=None):
+    argv = list(argv or sys.argv[1:])
+    if "--version" in argv:
+        print("0.0.0-fake")
+        return 0
+    extra = []
+    if "--extra-heartbeats" in argv:
+        extra = json.loads(sys.stdin.readline() or "[]")
+    record = {"time": time.time(), "argv": argv, "extra_heartbeats": extra}
+    with open(LOG, "a") as out:
+        out.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(execute(sys.argv[1:]))
@@ -0,0 +1,305 @@
+"""Costs of the heartbeat pipeline, from the depsgraph handler to the client."""
+import contextlib
+import json
+import os
+import tempfile
+import time
+from types import ModuleType, SimpleNamespace
+from typing import Dict, Iterator, List
+
+from . import addon_module, fake_client_log, quiet, result, write_config
+
+# depsgraph_update_pre rates seen during editing, playback and sculpting
+EVENT_RATES = (60, 120, 240)
+# how much session time to simulate for each rate
+SIMULATED_SECONDS = 30 * 60
+
+
+class FakeClock:
+    """Both wall and monotonic time, advanced only by the benchmark"""
+
+    def __init__(self) -> None:
+        self.now = 1_600_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = time
+
+
+class _PatchedTime:
+    """The time module with the wall clock replaced"""
+
+    def __init__(self, clock: FakeClock) -> None:
+        self.time = clock.time
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+
+@contextlib.contextmanager
+def fake_clock(addon: ModuleType) -> Iterator[FakeClock]:
+    clock = FakeClock()
+    heartbeat_queue = addon_module("heartbeat_queue")
+    activity = addon_module("activity")
+    patches = [
+        (addon, "monotonic", clock.monotonic),
+        (activity, "monotonic", clock.monotonic),
+        (heartbeat_queue, "time", _PatchedTime(clock)),
+    ]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield clock
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+
+def bench_handle_activity(addon: ModuleType) -> List[Dict]:
+    """Mean cost of activity_handler per depsgraph event at realistic rates"""
+    results = []
+    handler = addon.activity_handler
+    perf_counter_ns = time.perf_counter_ns
+    for rate in EVENT_RATES:
+        events = rate * SIMULATED_SECONDS
+        step = 1 / rate
+        addon.bpy.data.filepath = f"/projects/shot_{rate}/shot_{rate}_010.blend"
+        addon.gate.mark_dirty()
+        with fake_clock(addon) as clock, quiet():
+            elapsed = 0
+            for _ in range(events):
+                clock.now += step
+                start = perf_counter_ns()
+                handler(None)
+                elapsed += perf_counter_ns() - start
+        results.append(
+            result(
+                "handle_activity",
+                elapsed / events,
+                "ns/event",
+                rate=rate,
+                simulated_seconds=SIMULATED_SECONDS,
+            )
+        )
+    return results
+
+
+def bench_render_session(addon: ModuleType) -> List[Dict]:
+    """Cost of depsgraph events during a render and the heartbeats it produces"""
+    results = []
+    handlers = addon.bpy.app.handlers
+    handler = addon.activity_handler
+    perf_counter_ns = time.perf_counter_ns
+    addon.bpy.data.filepath = "/projects/render/render_010.blend"
+    # a one and a four hour animation render with 240 events per second
+    for hours in (1, 4):
+        events = hours * 60 * 60 * 240
+        step = 1 / 240
+        with fake_clock(addon) as clock, quiet():
+            enqueued = addon.stats.heartbeats_enqueued
+            for render_init in handlers.render_init:
+                render_init(None)
+            elapsed = 0
+            for _ in range(events):
+                clock.now += step
+                start = perf_counter_ns()
+                handler(None)
+                elapsed += perf_counter_ns() - start
+            for render_complete in handlers.render_complete:
+                render_complete(None)
+            heartbeats = addon.stats.heartbeats_enqueued - enqueued
+        results.append(
+            result(
+                "render_session",
+                elapsed / events,
+                "ns/event",
+                hours=hours,
+                events=events,
+                heartbeats=heartbeats,
+            )
+        )
+    return results
+
+
+def bench_enqueue(addon: ModuleType, count: int = 20_000) -> List[Dict]:
+    """Throughput of HeartbeatQueue.enqueue when every call makes a heartbeat"""
+    queue = addon.heartbeat_queue
+    filenames = [f"/projects/assets/asset_{i:05d}.blend" for i in range(count)]
+    with quiet():
+        start = time.perf_counter()
+        for filename in filenames:
+            queue.enqueue(filename)
+        elapsed = time.perf_counter() - start
+    return [result("enqueue", count / elapsed, "heartbeats/s", count=count)]
+
+
+def bench_linked_libraries(
+    addon: ModuleType, libraries: int = 300, selected: int = 10, count: int = 20_000
+) -> List[Dict]:
+    """Cost of indexing the linked libraries on load and finding the ones
+    in use when a heartbeat is produced"""
+    bpy = addon.bpy
+    bpy.data.libraries = [
+        SimpleNamespace(
+            name=f"asset_{i:03d}.blend",
+            filepath=f"//../../assets/asset_{i:03d}/asset_{i:03d}.blend",
+            parent=None,
+        )
+        for i in range(libraries)
+    ]
+    # empties instancing collections of some of the libraries
+    bpy.context.selected_objects = [
+        SimpleNamespace(
+            library=None,
+            data=None,
+            override_library=None,
+            instance_collection=SimpleNamespace(library=library),
+        )
+        for library in bpy.data.libraries[:selected]
+    ]
+    bpy.data.filepath = "/projects/shots/sh010/sh010.blend"
+    # the queue would send a heartbeat per library in use with every heartbeat
+    index = addon_module("libraries").LibraryIndex()
+    perf_counter_ns = time.perf_counter_ns
+    try:
+        with quiet():
+            start = perf_counter_ns()
+            index.build()
+            build = perf_counter_ns() - start
+            start = perf_counter_ns()
+            for _ in range(count):
+                index.in_use()
+            in_use = (perf_counter_ns() - start) / count
+    finally:
+        bpy.data.libraries = []
+        bpy.context.selected_objects = []
+    params = {"libraries": libraries, "selected": selected}
+    return [
+        result("linked_libraries", build / 1e6, "ms", step="build", **params),
+        result("linked_libraries", in_use, "ns/heartbeat", step="in_use", **params),
+    ]
+
+
+def bench_guess_project_name(addon: ModuleType, count: int = 20_000) -> List[Dict]:
+    """Cost of guess_project_name for cached and new filenames"""
+    guess_project_name = addon_module("heartbeat_queue").guess_project_name
+    args = ("1234567890._", False, "", "")
+    filenames = [f"/projects/lookdev/material_{i:05d}.blend" for i in range(count)]
+    guess_project_name.cache_clear()
+    perf_counter_ns = time.perf_counter_ns
+    with quiet():
+        start = perf_counter_ns()
+        for filename in filenames:
+            guess_project_name(filename, *args)
+        miss = (perf_counter_ns() - start) / count
+        start = perf_counter_ns()
+        for _ in range(count):
+            guess_project_name(filenames[-1], *args)
+        hit = (perf_counter_ns() - start) / count
+    return [
+        result("guess_project_name", miss, "ns/call", cache="miss"),
+        result("guess_project_name", hit, "ns/call", cache="hit"),
+    ]
+
+
+def bench_resolve_project(addon: ModuleType, count: int = 20_000) -> List[Dict]:
+    """Cost of ProjectResolver.resolve for the files of an asset library"""
+    projects = addon_module("projects")
+    directories = 20
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(directories):
+            os.makedirs(os.path.join(root, "library", f"asset_{i:02d}"))
+        with open(os.path.join(root, projects.MARKER), "w") as out:
+            out.write("library\n")
+        filenames = [
+            os.path.join(root, "library", f"asset_{i % directories:02d}", f"{i}.blend")
+            for i in range(count)
+        ]
+        resolver = projects.ProjectResolver()
+        perf_counter_ns = time.perf_counter_ns
+        start = perf_counter_ns()
+        for filename in filenames[:directories]:
+            resolver.resolve(filename)
+        miss = (perf_counter_ns() - start) / directories
+        start = perf_counter_ns()
+        for filename in filenames:
+            resolver.resolve(filename)
+        hit = (perf_counter_ns() - start) / count
+    return [
+        result("resolve_project", miss, "ns/call", cache="miss"),
+        result("resolve_project", hit, "ns/call", cache="hit", directories=directories),
+    ]
+
+
+def bench_log(addon: ModuleType, count: int = 200_000) -> List[Dict]:
+    """Cost of a DEBUG log call in a hot path while debugging is off"""
+    log = addon_module("log")
+    write_config(addon, debug=False)
+    perf_counter_ns = time.perf_counter_ns
+    start = perf_counter_ns()
+    for i in range(count):
+        log.log(log.DEBUG, "heartbeat {} of {}", i, count)
+    elapsed = perf_counter_ns() - start
+    return [result("log", elapsed / count, "ns/call", level="DEBUG", debug=False)]
+
+
+def _client_calls(addon: ModuleType) -> int:
+    try:
+        with open(fake_client_log(addon)) as inp:
+            return sum(1 for _ in inp)
+    except FileNotFoundError:
+        return 0
+
+
+def _wait_for_calls(addon: ModuleType, calls: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while _client_calls(addon) < calls:
+        if time.monotonic() > deadline:
+            raise TimeoutError("The fake client did not receive the heartbeat")
+        time.sleep(0.001)
+
+
+def bench_flush_latency(addon: ModuleType, count: int = 20) -> List[Dict]:
+    """Time from enqueue until the fake client receives the heartbeat"""
+    write_config(addon, api_key="00000000-0000-0000-0000-000000000000", flush_window=0)
+    latencies = []
+    with quiet():
+        # start with a fresh queue and client process
+        addon.unregister()
+        addon.register()
+        addon.start_workers()
+        queue = addon.heartbeat_queue
+        for i in range(count):
+            calls = _client_calls(addon)
+            start = time.time()
+            queue.enqueue(f"/projects/latency/latency_{i:03d}.blend", is_write=True)
+            _wait_for_calls(addon, calls + 1)
+            with open(fake_client_log(addon)) as inp:
+                received = json.loads(inp.readlines()[-1])["time"]
+            latencies.append((received - start) * 1000)
+    warm = sorted(latencies[1:])
+    return [
+        result("flush_latency", latencies[0], "ms", client="cold"),
+        result("flush_latency", warm[len(warm) // 2], "ms", client="warm", stat="p50"),
+        result(
+            "flush_latency",
+            warm[int(len(warm) * 0.95)],
+            "ms",
+            client="warm",
+            stat="p95",
+        ),
+    ]
+
+
+BENCHMARKS = {
+    "handle_activity": bench_handle_activity,
+    "render_session": bench_render_session,
+    "enqueue": bench_enqueue,
+    "linked_libraries": bench_linked_libraries,
+    "guess_project_name": bench_guess_project_name,
+    "resolve_project": bench_resolve_project,
+    "log": bench_log,
+    "flush_latency": bench_flush_latency,
+}
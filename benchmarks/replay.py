@@ -0,0 +1,238 @@
+"""Replay a recorded activity trace through the add-on against the fake client.
+
+Traces are recorded in Blender with "Start/Stop Wakatime Trace Recording"
+in the Wakatime menu. Run from the repository root::
+
+    python -m benchmarks.replay TRACE [--speed 10] [--option name=value ...]
+
+The handlers see the recorded wall and monotonic time, so the heartbeat
+thresholds behave as in the recorded session. The sender runs in real
+time though: with --speed 0, the default, the trace is replayed as fast
+as possible and the flush window coalesces much more than it would in
+Blender; --speed 1 replays in real time.
+
+The report lists the heartbeats produced, when they were produced and
+the CPU time spent by the add-on and by the client.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from types import ModuleType
+from typing import Dict, List, Optional
+
+from . import addon_module, fake_client_log, load_addon, quiet, result, write_config
+from .pipeline import fake_clock
+
+API_KEY = "00000000-0000-0000-0000-000000000000"
+# the width of the timeline buckets, seconds of trace time
+TIMELINE_STEP = 60
+
+
+def _sent_heartbeats(addon: ModuleType, skip: int) -> List[float]:
+    """Times of the heartbeats passed to the fake client after the first calls"""
+    times = []
+    try:
+        with open(fake_client_log(addon)) as inp:
+            for line in list(inp)[skip:]:
+                record = json.loads(line)
+                argv = record["argv"]
+                times.append(float(argv[argv.index("--time") + 1]))
+                times.extend(float(hb["time"]) for hb in record["extra_heartbeats"])
+    except FileNotFoundError:
+        pass
+    return times
+
+
+def _client_calls(addon: ModuleType) -> int:
+    try:
+        with open(fake_client_log(addon)) as inp:
+            return sum(1 for _ in inp)
+    except FileNotFoundError:
+        return 0
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def replay(
+    addon: ModuleType,
+    path: str,
+    speed: float = 0,
+    heartbeat_frequency: Optional[float] = None,
+) -> Dict:
+    """Feed the events of the trace to the handlers and send the heartbeats"""
+    trace = addon_module("trace")
+    preferences = addon_module("preferences")
+    handlers = {
+        trace.LOAD_POST: addon.load_handler,
+        trace.SAVE_POST: addon.save_handler,
+        trace.DEPSGRAPH_UPDATE_PRE: addon.activity_handler,
+    }
+    props = preferences.WakatimeProjectProperties.instance()
+    default_frequency = props.heartbeat_frequency
+    if heartbeat_frequency is not None:
+        # as if it was changed in the project preferences
+        props.heartbeat_frequency = heartbeat_frequency
+    calls = _client_calls(addon)
+    enqueued = addon.stats.heartbeats_enqueued
+    events = 0
+    handler_ns = 0
+    first: Optional[float] = None
+    perf_counter_ns = time.perf_counter_ns
+    try:
+        # a fresh queue and client process, whose CPU time is counted
+        # once the client exits on unregister
+        addon.unregister()
+        addon.register()
+        addon.start_workers()
+        children_cpu = _children_cpu()
+        cpu = time.process_time()
+        started = time.monotonic()
+        with fake_clock(addon) as clock:
+            for event in trace.read_trace(path):
+                if first is None:
+                    first = event.time
+                if speed:
+                    delay = (event.time - first) / speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                clock.now = event.time
+                addon.bpy.data.filepath = event.filepath
+                start = perf_counter_ns()
+                handlers[event.kind](None)
+                handler_ns += perf_counter_ns() - start
+                events += 1
+            buffer = addon.heartbeat_queue.buffer_stats()
+            addon.unregister()
+        cpu = time.process_time() - cpu
+        children_cpu = _children_cpu() - children_cpu
+        elapsed = time.monotonic() - started
+    finally:
+        props.heartbeat_frequency = default_frequency
+        addon.register()
+    sent = sorted(_sent_heartbeats(addon, calls))
+    timeline: Dict[int, int] = {}
+    for heartbeat in sent:
+        minute = int((heartbeat - (first or 0)) // TIMELINE_STEP)
+        timeline[minute] = timeline.get(minute, 0) + 1
+    return {
+        "events": events,
+        "trace_s": clock.now - first if first is not None else 0,
+        "replay_s": elapsed,
+        "heartbeats_enqueued": addon.stats.heartbeats_enqueued - enqueued,
+        "heartbeats_sent": len(sent),
+        "client_calls": _client_calls(addon) - calls,
+        "buffer": buffer,
+        "timeline": {
+            "step_s": TIMELINE_STEP,
+            "heartbeats": [
+                timeline.get(i, 0) for i in range(max(timeline, default=-1) + 1)
+            ],
+        },
+        "cpu_s": cpu,
+        "handler_s": handler_ns / 1e9,
+        "client_cpu_s": children_cpu,
+    }
+
+
+def write_session(path: str, rate: int = 60, minutes: int = 30) -> None:
+    """A synthetic trace: editing a few files, saving, and a break"""
+    trace = addon_module("trace")
+    start = 1_600_000_000.0
+    writer = trace.TraceWriter(path, start)
+    files = [f"/projects/replay/shot_{i:03d}.blend" for i in range(3)]
+    for second in range(minutes * 60):
+        filepath = files[second // 600 % len(files)]
+        if second % 600 == 0:
+            writer.record(trace.LOAD_POST, filepath, start + second)
+        elif second % 300 == 0:
+            writer.record(trace.SAVE_POST, filepath, start + second)
+        # a five minute break in the middle of each file
+        if 240 <= second % 600 < 540:
+            continue
+        for i in range(rate):
+            now = start + second + i / rate
+            writer.record(trace.DEPSGRAPH_UPDATE_PRE, filepath, now)
+    writer.close()
+
+
+def bench_replay(addon: ModuleType) -> List[Dict]:
+    """Cost of replaying a synthetic 30 minute session as fast as possible"""
+    write_config(addon, api_key=API_KEY)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.trace")
+        write_session(path)
+        with quiet():
+            report = replay(addon, path)
+    params = {
+        "events": report["events"],
+        "heartbeats_sent": report["heartbeats_sent"],
+        "trace_s": round(report["trace_s"]),
+    }
+    return [
+        result("replay", report["cpu_s"] * 1000, "ms", cpu="add-on", **params),
+        result("replay", report["handler_s"] * 1000, "ms", cpu="handlers", **params),
+        result("replay", report["client_cpu_s"] * 1000, "ms", cpu="client", **params),
+    ]
+
+
+BENCHMARKS = {"replay": bench_replay}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.replay")
+    parser.add_argument("trace", help="a trace recorded by the add-on")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="how many times faster than recorded, 0 is as fast as possible",
+    )
+    parser.add_argument(
+        "--heartbeat-frequency",
+        type=float,
+        help="minutes between heartbeats of the same file, "
+        "instead of the add-on default",
+    )
+    parser.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="set a config option, e.g. flush_window=5 or transport=daemon",
+    )
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+    options = {"api_key": API_KEY}
+    for option in args.option:
+        name, sep, value = option.partition("=")
+        if not sep:
+            parser.error(f"expected NAME=VALUE, got {option}")
+        options[name] = value
+    addon = load_addon()
+    write_config(addon, **options)
+    with quiet():
+        addon.register()
+        try:
+            report = replay(addon, args.trace, args.speed, args.heartbeat_frequency)
+        finally:
+            addon.unregister()
+            if os.path.exists(fake_client_log(addon)):
+                os.remove(fake_client_log(addon))
+    report["options"] = options
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
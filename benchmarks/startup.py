@@ -0,0 +1,96 @@
+"""The add-on's contribution to Blender launch time.
+
+Every measurement runs in a fresh interpreter, because importing
+the add-on a second time in the same process costs nothing.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import ModuleType
+from typing import Dict, List
+
+from . import ADDON_DIR, result
+
+RUNS = 10
+# modules that should only be imported when the add-on needs them
+HEAVY_MODULES = (
+    "compileall",
+    "http.client",
+    "json",
+    "ssl",
+    "subprocess",
+    "urllib.request",
+    "zipfile",
+)
+
+
+def _probe() -> dict:
+    """Import and register the add-on, then handle the first load_post"""
+    import threading
+
+    preloaded = set(sys.modules)
+    from . import load_addon, quiet
+
+    with quiet():
+        start = time.perf_counter()
+        addon = load_addon()
+        imported = time.perf_counter()
+        addon.register()
+        registered = time.perf_counter()
+        threads = threading.active_count()
+        addon.load_handler(None)
+        handled = time.perf_counter()
+        addon.unregister()
+    return {
+        "import_ms": (imported - start) * 1000,
+        "register_ms": (registered - imported) * 1000,
+        "first_event_ms": (handled - registered) * 1000,
+        "threads_after_register": threads - 1,
+        "heavy_modules": [
+            m for m in HEAVY_MODULES if m in sys.modules and m not in preloaded
+        ],
+    }
+
+
+def bench_startup(_addon: ModuleType) -> List[Dict]:
+    """Cost of importing and registering the add-on at Blender startup"""
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # the add-on logs to stdout, so the results are written to a file
+        output = os.path.join(tmp, "startup.json")
+        for _ in range(RUNS):
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup", output],
+                cwd=ADDON_DIR,
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            with open(output) as inp:
+                runs.append(json.load(inp))
+    params = {
+        "runs": RUNS,
+        "threads_after_register": runs[0]["threads_after_register"],
+        "heavy_modules": runs[0]["heavy_modules"],
+    }
+    return [
+        result(
+            "startup",
+            statistics.median(run[f"{step}_ms"] for run in runs),
+            "ms",
+            step=step,
+            **params,
+        )
+        for step in ("import", "register", "first_event")
+    ]
+
+
+BENCHMARKS = {"startup": bench_startup}
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "w") as out:
+        json.dump(_probe(), out)
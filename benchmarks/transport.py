@@ -0,0 +1,132 @@
+"""Heartbeats posted by the http transport to a local stand-in for the API."""
+import contextlib
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+from typing import Dict, Iterator, List
+
+from . import quiet, result, write_config
+
+API_KEY = "00000000-0000-0000-0000-000000000000"
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Accepts heartbeats at the bulk endpoint, like api.wakatime.com does"""
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _ApiHandler)
+        self.heartbeats: List[Dict] = []
+        self.received: List[float] = []
+        self.connections = 0
+        self.errors: List[str] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v1"
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server: ApiServer
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/api/v1/users/current/heartbeats.bulk":
+            self.server.errors.append(f"unexpected path {self.path}")
+            return self._reply(404, {"error": "Not Found"})
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        else:
+            self.server.errors.append("the body is not compressed")
+        heartbeats = json.loads(body)
+        self.server.heartbeats.extend(heartbeats)
+        self.server.received.append(time.time())
+        self._reply(202, {"responses": [[{"data": hb}, 201] for hb in heartbeats]})
+
+    def log_message(self, *_args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_api() -> Iterator[ApiServer]:
+    server = ApiServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _wait_for_requests(server: ApiServer, requests: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while len(server.received) < requests:
+        if time.monotonic() > deadline:
+            raise TimeoutError("The API did not receive the heartbeat")
+        time.sleep(0.001)
+
+
+def bench_http_transport(addon: ModuleType, count: int = 20) -> List[Dict]:
+    """Time from enqueue until the API receives the heartbeat"""
+    latencies = []
+    with serve_api() as server, quiet():
+        write_config(
+            addon, api_key=API_KEY, flush_window=0, transport="http", api_url=server.url
+        )
+        try:
+            addon.unregister()
+            addon.register()
+            addon.start_workers()
+            queue = addon.heartbeat_queue
+            for i in range(count):
+                requests = len(server.received)
+                start = time.time()
+                queue.enqueue(f"/projects/http/http_{i:03d}.blend", is_write=True)
+                _wait_for_requests(server, requests + 1)
+                latencies.append((server.received[-1] - start) * 1000)
+        finally:
+            write_config(addon, transport="cli")
+    if server.errors:
+        raise RuntimeError(", ".join(server.errors))
+    warm = sorted(latencies[1:])
+    params = {"connections": server.connections, "heartbeats": len(server.heartbeats)}
+    return [
+        result("http_transport", latencies[0], "ms", connection="cold", **params),
+        result(
+            "http_transport",
+            warm[len(warm) // 2],
+            "ms",
+            connection="warm",
+            stat="p50",
+            **params,
+        ),
+        result(
+            "http_transport",
+            warm[int(len(warm) * 0.95)],
+            "ms",
+            connection="warm",
+            stat="p95",
+            **params,
+        ),
+    ]
+
+
+BENCHMARKS = {"http_transport": bench_http_transport}
@@ -0,0 +1,43 @@
+from math import inf
+from time import monotonic
+
+
+class ActivityGate:
+    """Lock-free rate gate in front of the depsgraph_update_pre handler.
+
+    The handler takes the slow path through HeartbeatQueue.enqueue only
+    when the gate is dirty or its deadline on the monotonic clock has passed.
+    Both fields are plain attributes that are only ever replaced as a whole,
+    so the check needs neither a lock nor a call into bpy.
+    The events counter is only updated by the main thread.
+
+    While suppressed, during renders and animation playback,
+    the gate stays closed whatever happens.
+    """
+
+    __slots__ = ("deadline", "dirty", "events", "suppressed")
+
+    def __init__(self) -> None:
+        self.deadline = 0.0
+        self.dirty = True
+        self.events = 0
+        self.suppressed = False
+
+    def close(self, interval: float) -> None:
+        self.deadline = inf if self.suppressed else monotonic() + interval
+        self.dirty = False
+
+    def mark_dirty(self) -> None:
+        if not self.suppressed:
+            self.dirty = True
+
+    def suppress(self, suppressed: bool) -> None:
+        self.suppressed = suppressed
+        if suppressed:
+            self.deadline = inf
+            self.dirty = False
+        else:
+            self.dirty = True
+
+
+gate = ActivityGate()
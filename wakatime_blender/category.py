@@ -0,0 +1,84 @@
+"""The kind of work done in Blender, sent as the category of the heartbeats.
+
+Rendering counts as building, watching the animation play back as
+debugging, and the time in the text editor or the python console as
+coding; everything else, in any mode, is designing.
+
+The context is not inspected for every depsgraph event. The render and
+playback handlers and msgbus subscriptions to the properties that change
+the main editor only mark the tracker dirty, and the category is
+detected again the next time a heartbeat is due.
+"""
+import bpy
+from .activity import gate
+
+CODING = "coding"
+DESIGNING = "designing"
+DEBUGGING = "debugging"
+BUILDING = "building"
+
+# the category of the time spent in these editors, designing otherwise
+EDITOR_CATEGORIES = {"TEXT_EDITOR": CODING, "CONSOLE": CODING}
+
+# properties that change which editor is the main one
+_SUBSCRIPTIONS = (
+    (bpy.types.Window, "workspace"),
+    (bpy.types.Window, "screen"),
+    (bpy.types.Area, "type"),
+    (bpy.types.Area, "ui_type"),
+)
+
+
+def main_editor() -> str:
+    """The type of the largest area of the current screen"""
+    try:
+        areas = bpy.context.screen.areas
+        return max(areas, key=lambda area: area.width * area.height).type
+    except (AttributeError, ValueError):
+        return ""
+
+
+class CategoryTracker:
+    def __init__(self) -> None:
+        self.dirty = True
+        self.rendering = False
+        self.playing = False
+        self._category = DESIGNING
+
+    def mark_dirty(self, *_args) -> None:
+        self.dirty = True
+        # the change should be sent even if a heartbeat was sent just now
+        gate.mark_dirty()
+
+    def set_rendering(self, rendering: bool) -> None:
+        self.rendering = rendering
+        self.mark_dirty()
+
+    def set_playing(self, playing: bool) -> None:
+        self.playing = playing
+        self.mark_dirty()
+
+    def current(self) -> str:
+        if self.dirty:
+            self.dirty = False
+            if self.rendering:
+                self._category = BUILDING
+            elif self.playing:
+                self._category = DEBUGGING
+            else:
+                self._category = EDITOR_CATEGORIES.get(main_editor(), DESIGNING)
+        return self._category
+
+    def subscribe(self) -> None:
+        """Watch the editors; the subscriptions are dropped when a file is loaded"""
+        for struct, prop in _SUBSCRIPTIONS:
+            bpy.msgbus.subscribe_rna(
+                key=(struct, prop), owner=self, args=(), notify=self.mark_dirty
+            )
+        self.mark_dirty()
+
+    def unsubscribe(self) -> None:
+        bpy.msgbus.clear_by_owner(self)
+
+
+categories = CategoryTracker()
@@ -0,0 +1,114 @@
+"""Long-lived wrapper around the legacy wakatime client.
+
+The script is started by HeartbeatQueue with Blender's python:
+
+    python client_worker.py <path to wakatime/cli.py>
+
+It imports the client once and then serves requests from stdin,
+calling the client's entry point in-process instead of starting
+a new interpreter for every heartbeat.
+
+Each request is a JSON header line {"argv": [...], "extra_heartbeats": bool}.
+If extra_heartbeats is true, it is followed by one line per JSON-encoded
+extra heartbeat and an empty line that ends the request; the extra
+heartbeats are passed to the client as a single JSON array on its stdin.
+For each request a single JSON line {"retcode": int, "output": str}
+is written to stdout.
+
+This module must not import bpy or anything from the add-on,
+it is also used by sender_daemon.py.
+"""
+import io
+import json
+import runpy
+import sys
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+Entry = Callable[[List[str]], Optional[int]]
+
+
+def client_argv(
+    heartbeat: dict, plugin: str, verbose: bool, extra_heartbeats: bool
+) -> List[str]:
+    """Command line arguments of the client for the heartbeat,
+    as produced by HeartBeat.to_cli()"""
+    argv = [
+        "--entity",
+        heartbeat["entity"],
+        "--time",
+        f"{heartbeat['time']:f}",
+        "--plugin",
+        plugin,
+    ]
+    if "project" in heartbeat:
+        argv.extend(["--project", heartbeat["project"]])
+    else:
+        argv.extend(["--alternate-project", heartbeat["alternate_project"]])
+    if heartbeat.get("category"):
+        argv.extend(["--category", heartbeat["category"]])
+    if heartbeat["is_write"]:
+        argv.append("--write")
+    if verbose:
+        argv.append("--verbose")
+    if extra_heartbeats:
+        argv.append("--extra-heartbeats")
+    return argv
+
+
+def load_client(client_path: str) -> Entry:
+    namespace = runpy.run_path(client_path, run_name="wakatime_client")
+    wakatime = namespace.get("wakatime")
+    entry = getattr(wakatime, "execute", None) or namespace.get("execute")
+    if entry is None:
+        raise ImportError(f"No entry point found in {client_path}")
+    return entry
+
+
+def execute(entry: Entry, argv: List[str], stdin: str) -> Tuple[int, str]:
+    """Run the client like a separate process would: capture its output,
+    feed it the stdin and convert SystemExit to the return code."""
+    output = io.StringIO()
+    saved = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin = io.StringIO(stdin)
+    sys.stdout = sys.stderr = output
+    try:
+        retcode = entry(argv)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            retcode = e.code
+        else:
+            print(e.code, file=output)
+            retcode = 1
+    except Exception:
+        traceback.print_exc(file=output)
+        retcode = 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved
+    return retcode or 0, output.getvalue()
+
+
+def main() -> int:
+    requests = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    responses = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    entry = load_client(sys.argv[1])
+    while True:
+        line = requests.readline()
+        if not line:
+            return 0
+        header = json.loads(line)
+        extra = []
+        if header["extra_heartbeats"]:
+            for line in iter(requests.readline, ""):
+                line = line.strip()
+                if not line:
+                    break
+                extra.append(line)
+        stdin = f"[{','.join(extra)}]\n" if extra else ""
+        retcode, output = execute(entry, header["argv"], stdin)
+        responses.write(json.dumps({"retcode": retcode, "output": output}) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# what to do when the buffer is full
+DROP_OLDEST = "drop_oldest"
+SPILL = "spill"
+OVERFLOW_POLICIES = (DROP_OLDEST, SPILL)
+
+Spill = Callable[[list], None]
+
+
+class HeartbeatBuffer:
+    """Bounded buffer between the main thread and the worker thread.
+
+    Heartbeats of the same entity, project and category that fall into
+    the same time bucket are merged into the latest of them, while write heartbeats
+    are always kept. When the buffer is full, the oldest non-write
+    heartbeats are either dropped, or everything is spilled to disk.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        bucket: float,
+        policy: str = DROP_OLDEST,
+        spill: Optional[Spill] = None,
+    ) -> None:
+        self._capacity = max(capacity, 1)
+        self._bucket = max(bucket, 1)
+        self._policy = policy
+        self._spill = spill
+        self._cond = threading.Condition()
+        self._items: Dict[Hashable, tuple] = OrderedDict()
+        self._writes = 0
+        self._has_new = False
+        self._closed = False
+        self.merged = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": len(self._items),
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+        }
+
+    def _key(self, heartbeat) -> Hashable:
+        if heartbeat.is_write:
+            self._writes += 1
+            return self._writes
+        return (
+            heartbeat.entity,
+            heartbeat.project,
+            heartbeat.category,
+            int(heartbeat.timestamp // self._bucket),
+        )
+
+    def _drop_oldest(self) -> None:
+        for key, heartbeat in self._items.items():
+            if not heartbeat.is_write:
+                del self._items[key]
+                self.dropped += 1
+                return
+
+    def _overflow(self) -> None:
+        if self._policy == SPILL and self._spill is not None:
+            items = list(self._items.values())
+            try:
+                self._spill(items)
+            except OSError:
+                pass
+            else:
+                self._items.clear()
+                self.spilled += len(items)
+                return
+        self._drop_oldest()
+
+    def put(self, heartbeat) -> None:
+        with self._cond:
+            key = self._key(heartbeat)
+            if key in self._items:
+                self.merged += 1
+            self._items[key] = heartbeat
+            if len(self._items) > self._capacity:
+                self._overflow()
+            self._has_new = True
+            self._cond.notify()
+
+    def put_back(self, heartbeats: list) -> None:
+        """Return heartbeats that could not be handled yet.
+
+        Unlike put, this does not wake up the worker."""
+        with self._cond:
+            items = self._items
+            self._items = OrderedDict()
+            for heartbeat in heartbeats:
+                self._items[self._key(heartbeat)] = heartbeat
+            self._items.update(items)
+            while len(self._items) > self._capacity:
+                count = len(self._items)
+                self._drop_oldest()
+                if len(self._items) == count:
+                    break
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until new heartbeats arrive or the buffer is closed.
+
+        Returns False if the timeout expired first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._has_new or self._closed, timeout)
+
+    def get_batch(self, window: float) -> Tuple[List, bool]:
+        """Collect heartbeats for the window and take everything out of the buffer.
+
+        Returns the heartbeats and whether the buffer was closed."""
+        with self._cond:
+            deadline = time.monotonic() + window
+            while not self._closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+            batch = list(self._items.values())
+            self._items.clear()
+            self._has_new = False
+            return batch, self._closed
+
+    def drain(self) -> List:
+        """Take everything out of the buffer without waiting"""
+        with self._cond:
+            items = list(self._items.values())
+            self._items.clear()
+            self._has_new = False
+            return items
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
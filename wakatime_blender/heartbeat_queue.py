@@ -1,19 +1,49 @@
-import json
 import os
 import sys
 import threading
 import time
-from dataclasses import dataclass
 from functools import lru_cache
-from queue import Empty, Queue
-from subprocess import PIPE, Popen, STDOUT
-from typing import List, Optional
+from itertools import islice
+from typing import (
+    TYPE_CHECKING,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 import bpy
-from .log import DEBUG, ERROR, INFO, log
+from .activity import gate
+from .category import categories
+from .heartbeat_buffer import DROP_OLDEST, HeartbeatBuffer, OVERFLOW_POLICIES
+from .libraries import LibraryIndex
+from .log import DEBUG, ERROR, WARNING, log
 from . import settings
 from .utils import u
-from .preferences import WakatimeProjectProperties
+from .preferences import ProjectSettings, WakatimeProjectProperties
+from .projects import ProjectResolver
+from .retry import (
+    CLIENT_API_ERROR,
+    CLIENT_AUTH_ERROR,
+    CLIENT_SUCCESS,
+    DELIVERED,
+    FAILURE,
+    REJECTED,
+    REJECTED_CODE,
+    RetryScheduler,
+    SUCCESS,
+    UNREACHABLE_CODE,
+)
+from .rollups import rollups
+from .sessions import SessionTracker
+from .spool import Record, Spool, SpoolPosition
+from .stats import stats
+
+if TYPE_CHECKING:
+    from subprocess import Popen
 
 
 @lru_cache(maxsize=128)
@@ -37,151 +67,949 @@ def guess_project_name(
     name = name.rstrip(truncate_trail)
     # tune project-name with pre- and postfix
     name = f"{project_prefix}{name}{project_postfix}"
-    log(INFO, "project-name in Wakatime: {}", name)
+    log(DEBUG, "project-name in Wakatime: {}", name)
     return name
 
 
-@dataclass
-class HeartBeat:
+class HeartBeat(NamedTuple):
     entity: str
     project: str
     timestamp: float
     is_write: bool = False
+    category: str = ""
+    # the project was named by a marker or a studio root and
+    # takes precedence over the detection of the client
+    explicit_project: bool = False
+    # the project settings of the file, until the worker thread
+    # resolves the project; None once the project is known
+    project_settings: Optional[ProjectSettings] = None
+
+    def to_cli(self, overwrite_project: bool) -> dict:
+        """The heartbeat as expected by the client in --extra-heartbeats"""
+        heartbeat = {
+            "entity": self.entity,
+            "type": "file",
+            "time": self.timestamp,
+            "is_write": self.is_write,
+            "project"
+            if overwrite_project or self.explicit_project
+            else "alternate_project": self.project,
+        }
+        if self.category:
+            heartbeat["category"] = self.category
+        return heartbeat
+
+    def to_api(self) -> dict:
+        """The heartbeat as expected by the heartbeats API"""
+        heartbeat = {
+            "entity": self.entity,
+            "type": "file",
+            "time": self.timestamp,
+            "is_write": self.is_write,
+            "project": self.project,
+        }
+        if self.category:
+            heartbeat["category"] = self.category
+        return heartbeat
+
+
+class ClientProcess:
+    """Long-lived wakatime client worker process, see client_worker.py
+
+    The process is started on the first request and restarted
+    if it crashes, so the client is imported once per session
+    instead of once per heartbeat.
+    json and subprocess are imported with the first request,
+    so that they do not add to Blender startup.
+    """
+
+    WORKER = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "client_worker.py"
+    )
+    # mimics a crashed client process
+    CRASHED = 1
+
+    def __init__(self) -> None:
+        self._process: Optional["Popen"] = None
+        self._client_path = ""
+        self._encoder = self._decoder = None
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self) -> None:
+        import json
+        from subprocess import PIPE, Popen
+
+        log(DEBUG, "Starting wakatime client worker")
+        stats.client_spawns += 1
+        if self._encoder is None:
+            self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+            self._decoder = json.JSONDecoder()
+        self._client_path = settings.api_client()
+        self._process = Popen(
+            [sys.executable, self.WORKER, self._client_path],
+            stdin=PIPE,
+            stdout=PIPE,
+        )
+
+    def _request(
+        self,
+        argv: List[str],
+        extra_heartbeats: Sequence[HeartBeat],
+        overwrite_project: bool,
+    ) -> Optional[dict]:
+        encode = self._encoder.encode
+        try:
+            write = self._process.stdin.write
+            header = {"argv": argv, "extra_heartbeats": bool(extra_heartbeats)}
+            write(f"{encode(header)}\n".encode("utf-8"))
+            if extra_heartbeats:
+                # stream the heartbeats as they are encoded,
+                # instead of building the whole payload first
+                for hb in extra_heartbeats:
+                    write(f"{encode(hb.to_cli(overwrite_project))}\n".encode("utf-8"))
+                write(b"\n")
+            self._process.stdin.flush()
+            response = self._process.stdout.readline()
+        except OSError:
+            return None
+        return self._decoder.decode(response.decode("utf-8")) if response else None
+
+    def send(
+        self,
+        argv: List[str],
+        extra_heartbeats: Sequence[HeartBeat],
+        overwrite_project: bool,
+    ) -> Tuple[int, str]:
+        """Pass the arguments to the client and return its (retcode, output)"""
+        if self.alive and self._client_path != settings.api_client():
+            # a new client version was installed
+            self.close()
+        for _attempt in range(2):
+            if not self.alive:
+                self.close()
+                self._start()
+            response = self._request(argv, extra_heartbeats, overwrite_project)
+            if response is not None:
+                return response["retcode"], response["output"]
+            log(ERROR, "wakatime client worker crashed, restarting")
+            self.close()
+        return self.CRASHED, "wakatime client worker keeps crashing"
+
+    def close(self, timeout: float = 1) -> None:
+        if self._process is None:
+            return
+        from subprocess import TimeoutExpired
+
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+            process.wait(timeout)
+        except (OSError, TimeoutExpired):
+            process.kill()
+        process.stdout.close()
+
+
+class HttpTransport:
+    """Posts heartbeats straight to the bulk endpoint of the wakatime API.
+
+    The connection is kept alive between sends and reopened when
+    the "api_url", "proxy" or "no_ssl_verify" options change.
+    The outcome is reported with the return codes of the client where
+    they mean the same, and with codes of the add-on's own otherwise,
+    see retry.py, so that all transports are handled the same way.
+    """
+
+    API_URL = "https://api.wakatime.com/api/v1"
+    # "api_url" may name an endpoint instead of the base url of the API
+    ENDPOINT_SUFFIXES = (
+        "/users/current/heartbeats.bulk",
+        "/users/current/heartbeats",
+        "/heartbeats.bulk",
+        "/heartbeats",
+    )
+    # default of the "timeout" option, seconds
+    TIMEOUT = 60
+
+    def __init__(self) -> None:
+        self._connection = None
+        self._options: Optional[Tuple[str, str, bool]] = None
+        self._path = ""
+        self._headers: dict = {}
+        self._encoder = None
+
+    @staticmethod
+    def _current_options() -> Tuple[str, str, bool]:
+        return (
+            settings.get("api_url") or HttpTransport.API_URL,
+            settings.get("proxy", ""),
+            settings.get_bool("no_ssl_verify"),
+        )
+
+    @staticmethod
+    def supported() -> bool:
+        """Whether the configured proxy can be used without the client.
+
+        Only plain http proxies are; https, socks and NTLM proxies
+        are left to the client."""
+        proxy = settings.get("proxy", "")
+        if not proxy:
+            return True
+        return "\\" not in proxy and (proxy.startswith("http://") or "://" not in proxy)
+
+    @staticmethod
+    def reachable(timeout: float = 3) -> bool:
+        """Cheap check that the API, or the proxy, accepts connections"""
+        import socket
+        from urllib.parse import urlsplit
+
+        api_url, proxy, _ = HttpTransport._current_options()
+        if proxy:
+            url = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        else:
+            url = urlsplit(api_url)
+        port = url.port or {"https": 443, "http": 80}.get(url.scheme, 1080)
+        try:
+            socket.create_connection((url.hostname, port), timeout).close()
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _basic_auth(credentials: str) -> str:
+        import base64
+
+        return "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+    def _connect(self):
+        import http.client
+        import ssl
+        from urllib.parse import unquote, urlsplit
+
+        self._options = api_url, proxy, no_ssl_verify = self._current_options()
+        url = urlsplit(api_url)
+        path = url.path.rstrip("/")
+        # the legacy client is configured with the endpoint itself
+        for suffix in self.ENDPOINT_SUFFIXES:
+            if path.endswith(suffix):
+                path = path[: -len(suffix)]
+                break
+        self._path = f"{path}/users/current/heartbeats.bulk"
+        self._headers = {}
+        timeout = settings.parse("timeout", float, self.TIMEOUT)
+        host, port = url.hostname, url.port
+        proxy_headers = {}
+        if proxy:
+            proxy_url = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            if proxy_url.username:
+                proxy_headers["Proxy-Authorization"] = self._basic_auth(
+                    f"{unquote(proxy_url.username)}:{unquote(proxy_url.password or '')}"
+                )
+            host, port = proxy_url.hostname, proxy_url.port or 80
+        if url.scheme == "https":
+            context = (
+                ssl._create_unverified_context()
+                if no_ssl_verify
+                else ssl.create_default_context()
+            )
+            connection = http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=context
+            )
+            if proxy:
+                connection.set_tunnel(url.hostname, url.port, headers=proxy_headers)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+            if proxy:
+                # plain http requests go to the proxy with the full url
+                self._path = f"{url.scheme}://{url.netloc}{self._path}"
+                self._headers.update(proxy_headers)
+        self._connection = connection
+        return connection
+
+    def _encode(self, heartbeats: Sequence[HeartBeat]) -> bytes:
+        import gzip
+        import json
+
+        if self._encoder is None:
+            self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        body = self._encoder.encode([hb.to_api() for hb in heartbeats])
+        return gzip.compress(body.encode("utf-8"), compresslevel=6)
+
+    def send(self, heartbeats: Sequence[HeartBeat], user_agent: str) -> Tuple[int, str]:
+        """Post the heartbeats and return (retcode, output) like the client does"""
+        import http.client
+
+        if self._connection is not None and self._options != self._current_options():
+            self.close()
+        headers = {
+            "Authorization": self._basic_auth(settings.api_key()),
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Accept": "application/json",
+            "User-Agent": user_agent,
+        }
+        body = self._encode(heartbeats)
+        # a kept-alive connection may have been closed by the server meanwhile,
+        # in which case the request is repeated once on a new connection
+        reused = self._connection is not None
+        while True:
+            connection = self._connection or self._connect()
+            try:
+                headers.update(self._headers)
+                connection.request("POST", self._path, body, headers)
+                response = connection.getresponse()
+                output = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if reused:
+                    reused = False
+                    continue
+                return UNREACHABLE_CODE, f"Unable to connect to the API: {e}"
+            break
+        if response.will_close:
+            self.close()
+        status = response.status
+        if 200 <= status < 300:
+            return CLIENT_SUCCESS, ""
+        output = u(output)
+        if status in (401, 403):
+            return CLIENT_AUTH_ERROR, output
+        if status == 429 or status >= 500:
+            # the server will accept the heartbeats later
+            return UNREACHABLE_CODE, f"{status} {response.reason}: {output}"
+        # the heartbeats were rejected, like the client they are not retried
+        return REJECTED_CODE, f"{status} {response.reason}: {output}"
+
+    def close(self) -> None:
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            connection.close()
+
+
+class SenderDaemonClient:
+    """Sends heartbeats through the sender daemon shared by all Blender
+    instances of the user, see sender_daemon.py
+
+    The daemon is started if it is not running yet, and the connection
+    is kept open for the whole session.
+    """
+
+    DAEMON = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "sender_daemon.py"
+    )
+    # how long to wait for a newly started daemon, seconds
+    START_TIMEOUT = 5
+
+    def __init__(self) -> None:
+        self._socket = None
+        self._stream = None
+        self._encoder = None
+
+    @staticmethod
+    def supported() -> bool:
+        import socket
+
+        return hasattr(socket, "AF_UNIX") and os.name == "posix"
+
+    def _spawn(self) -> None:
+        import subprocess
+
+        log(DEBUG, "Starting wakatime sender daemon")
+        stats.client_spawns += 1
+        subprocess.Popen(
+            [sys.executable, self.DAEMON, settings.SENDER_SOCKET],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # the daemon outlives this Blender instance
+            start_new_session=True,
+        )
+
+    def _connect(self) -> None:
+        import json
+        import socket
+
+        if self._encoder is None:
+            self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        deadline = time.monotonic() + self.START_TIMEOUT
+        spawned = False
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(settings.SENDER_SOCKET)
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if not spawned:
+                    self._spawn()
+                    spawned = True
+                elif time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+                continue
+            except OSError:
+                sock.close()
+                raise
+            break
+        self._socket = sock
+        self._stream = sock.makefile("rwb")
+
+    def send(
+        self,
+        heartbeats: Sequence[HeartBeat],
+        user_agent: str,
+        overwrite_project: bool,
+        verbose: bool,
+    ) -> Tuple[int, str]:
+        """Pass the heartbeats to the daemon and return the client's (retcode, output).
+
+        Raises OSError if the daemon cannot be reached."""
+        import json
+
+        for _attempt in range(2):
+            if self._stream is None:
+                self._connect()
+            encode = self._encoder.encode
+            header = {
+                "client": settings.api_client(),
+                "plugin": user_agent,
+                "overwrite_project": overwrite_project,
+                "verbose": verbose,
+                "heartbeats": len(heartbeats),
+            }
+            try:
+                write = self._stream.write
+                write(f"{encode(header)}\n".encode("utf-8"))
+                for hb in heartbeats:
+                    write(f"{encode(hb.to_cli(overwrite_project))}\n".encode("utf-8"))
+                self._stream.flush()
+                response = self._stream.readline()
+            except OSError:
+                response = b""
+            if response:
+                response = json.loads(response)
+                return response["retcode"], response["output"]
+            # the daemon exited, e.g. after being idle; start a new one
+            self.close()
+        raise ConnectionError("wakatime sender daemon keeps crashing")
+
+    def close(self) -> None:
+        if self._socket is None:
+            return
+        sock, self._socket = self._socket, None
+        stream, self._stream = self._stream, None
+        try:
+            stream.close()
+        except OSError:
+            pass
+        sock.close()
 
 
 class HeartbeatQueue(threading.Thread):
-    POLL_INTERVAL = 1
+    # how long to wait for more heartbeats to send them in one batch;
+    # can be changed with the "flush_window" option in the wakatime config
+    FLUSH_WINDOW = 2
+    # how long stopping the queue may take, in Blender's interactive
+    # and background sessions alike; can be changed with the
+    # "shutdown_deadline" option in the wakatime config
+    SHUTDOWN_DEADLINE = 3
+    # how many heartbeats to send with a single client call;
+    # can be changed with the "max_heartbeats_per_send" option
+    MAX_HEARTBEATS_PER_SEND = 100
+    # defaults of the "buffer_capacity", "coalesce_bucket" and "buffer_overflow"
+    # options in the wakatime config
+    BUFFER_CAPACITY = 1000
+    COALESCE_BUCKET = 60
+    # how often a spooled chunk is sent while the API is reachable,
+    # before it is dropped as one that the client cannot send
+    MAX_CHUNK_ATTEMPTS = 5
+    # values of the "transport" option: heartbeats are sent either by
+    # the wakatime client, the default, posted to the API directly,
+    # or passed to the sender daemon shared by all Blender instances
+    TRANSPORT_CLI = "cli"
+    TRANSPORT_HTTP = "http"
+    TRANSPORT_DAEMON = "daemon"
 
     def __init__(self, version: str) -> None:
         super().__init__()
         self.daemon = True
         self._version = version
-        self._queue = Queue()
-        self._last_hb: Optional[HeartBeat] = None
-        self._lock = threading.Lock()
-        self._running = True
-
-    def _enough_time_passed(self, now, is_write):
-        props = WakatimeProjectProperties.instance()
-        return self._last_hb is None or (
-            now - self._last_hb.timestamp
-            > (
-                2
-                if is_write
-                else min(1, (2 if not props else props.heartbeat_frequency) * 60)
-            )
+        policy = settings.get("buffer_overflow", DROP_OLDEST)
+        self._buffer = HeartbeatBuffer(
+            settings.parse("buffer_capacity", int, self.BUFFER_CAPACITY),
+            settings.parse("coalesce_bucket", float, self.COALESCE_BUCKET),
+            policy if policy in OVERFLOW_POLICIES else DROP_OLDEST,
+            self._spill,
         )
+        stats.add_source("buffer", self._buffer.stats)
+        self._retry = RetryScheduler(HttpTransport.reachable)
+        stats.add_source("retry", self._retry.stats)
+        self._last_hb: Optional[HeartBeat] = None
+        self._resolver = ProjectResolver()
+        stats.add_source("projects", self._resolver.stats)
+        self._sessions = SessionTracker()
+        self._library_index = LibraryIndex()
+        # the file of the latest heartbeat and the libraries in use;
+        # replaced as a whole by the main thread, read by the worker
+        self._libraries: Tuple[str, Tuple[str, ...]] = ("", ())
+        self._client = ClientProcess()
+        self._http = HttpTransport()
+        self._daemon = SenderDaemonClient()
+        self._spool: Optional[Spool] = None
+        # the end of the spooled chunk that failed and how often it did
+        self._failed_chunk = (SpoolPosition(-1, -1), 0)
+        # the spilled heartbeats up to here were resolved and counted
+        self._read_back_to = SpoolPosition(-1, -1)
+        # monotonic time by which the worker has to be done, once stopping
+        self._deadline: Optional[float] = None
+
+    @staticmethod
+    def _heartbeat_interval() -> float:
+        return WakatimeProjectProperties.snapshot().heartbeat_frequency * 60
+
+    def _time_to_next_heartbeat(self, now: float, interval: float) -> float:
+        if self._last_hb is None:
+            return 0
+        return self._last_hb.timestamp + interval - now
 
     def enqueue(self, filename: str, is_write=False):
         timestamp = time.time()
-        last_file = self._last_hb.entity if self._last_hb is not None else ""
-        if (
-            not filename
-            or filename == last_file
-            and not self._enough_time_passed(timestamp, is_write)
-        ):
+        interval = self._heartbeat_interval()
+        if not filename:
+            gate.close(interval)
             return
-        props = WakatimeProjectProperties.instance()
-        project_name = guess_project_name(
+        category = categories.current()
+        last = self._last_hb
+        # a change of the category is sent right away
+        if last is not None and last.entity == filename and last.category == category:
+            wait = self._time_to_next_heartbeat(timestamp, 2 if is_write else interval)
+            if wait > 0:
+                gate.close(wait)
+                return
+        # the project is resolved by the worker thread, see _resolve_projects
+        props = WakatimeProjectProperties.snapshot()
+        if settings.get_bool("track_linked_libraries"):
+            self._libraries = (filename, self._library_index.in_use())
+        self._last_hb = HeartBeat(
             filename,
-            props.truncate_trail if props else "",
-            props.use_project_folder if props else False,
-            props.project_prefix if props else "",
-            props.project_postfix if props else "",
+            "",
+            timestamp,
+            is_write,
+            category=category,
+            project_settings=props,
         )
-        self._last_hb = HeartBeat(filename, project_name, timestamp, is_write)
-        self._queue.put_nowait(self._last_hb)
+        self._buffer.put(self._last_hb)
+        stats.heartbeats_enqueued += 1
+        gate.close(interval)
+
+    def _enqueue_at(self, filename: str, timestamps: List[float], category: str):
+        """Put heartbeats of the file with the timestamps into the buffer,
+        without any rate limiting"""
+        if not filename:
+            return
+        props = WakatimeProjectProperties.snapshot()
+        for timestamp in timestamps:
+            self._last_hb = HeartBeat(
+                filename,
+                "",
+                timestamp,
+                category=category,
+                project_settings=props,
+            )
+            self._buffer.put(self._last_hb)
+            stats.heartbeats_enqueued += 1
+
+    def start_session(self, kind: str, filename: str, category: str) -> None:
+        """A render or playback started, see sessions.py"""
+        timestamp = time.time()
+        self._sessions.start(kind, filename, category, timestamp)
+        gate.suppress(True)
+        self._enqueue_at(filename, [timestamp], category)
+
+    def finish_session(self, kind: str) -> None:
+        finished = self._sessions.finish(kind, time.time())
+        gate.suppress(self._sessions.active())
+        if finished is not None:
+            log(
+                DEBUG,
+                "Sending {} {} heartbeats for {}",
+                len(finished.timestamps),
+                kind,
+                finished.filename,
+            )
+            self._enqueue_at(finished.filename, finished.timestamps, finished.category)
+
+    def finish_sessions(self) -> None:
+        for kind in self._sessions.kinds():
+            self.finish_session(kind)
+
+    def index_libraries(self) -> None:
+        """Index the libraries of the file that was just loaded"""
+        if settings.get_bool("track_linked_libraries"):
+            self._library_index.build()
+        else:
+            self._library_index.clear()
+
+    def _project(self, entity: str, props: ProjectSettings) -> Tuple[str, bool]:
+        """The name of the project of the file and whether it is explicit"""
+        if not props.always_overwrite_name:
+            # the name constructed from the settings is only a fallback,
+            # unless it overwrites the project discovery
+            project = self._resolver.resolve(entity)
+            if project is not None:
+                return project
+        name = guess_project_name(
+            entity,
+            props.truncate_trail,
+            props.use_project_folder,
+            props.project_prefix,
+            props.project_postfix,
+        )
+        return name, False
+
+    def _with_project(
+        self, heartbeat: HeartBeat, props: ProjectSettings, **changes
+    ) -> HeartBeat:
+        name, explicit = self._project(changes.get("entity", heartbeat.entity), props)
+        return heartbeat._replace(
+            project=name, explicit_project=explicit, project_settings=None, **changes
+        )
+
+    def _resolve_projects(self, heartbeats: List[HeartBeat]) -> List[HeartBeat]:
+        """Set the projects of the new heartbeats and count their time.
+
+        New heartbeats of a file are followed by heartbeats of the
+        libraries in use, which are sent as extra heartbeats in the same
+        client call, and which are not counted locally.
+        Heartbeats that were put back or flushed are resolved already."""
+        resolved = []
+        for heartbeat in heartbeats:
+            props = heartbeat.project_settings
+            if props is None:
+                resolved.append(heartbeat)
+                continue
+            heartbeat = self._with_project(heartbeat, props)
+            rollups.add(heartbeat.timestamp, heartbeat.project, heartbeat.entity)
+            resolved.append(heartbeat)
+            filename, libraries = self._libraries
+            if heartbeat.entity == filename:
+                resolved.extend(
+                    self._with_project(heartbeat, props, entity=path, is_write=False)
+                    for path in libraries
+                )
+        return resolved
+
+    def _spill(self, heartbeats: List[HeartBeat]) -> None:
+        """Called by the buffer with its lock held, often in the main thread,
+        so the projects are resolved by the worker when it reads them back"""
+        if self._spool is None:
+            raise OSError("Heartbeat spool is not available")
+        self._spool.append(heartbeats)
+
+    def _read_back(self, chunk: List[Tuple[Record, SpoolPosition]]) -> List[HeartBeat]:
+        """The heartbeats of the spooled records.
+
+        Spilled heartbeats are resolved, and counted and followed by
+        heartbeats of the libraries only the first time they are read,
+        as a chunk that failed to send is read again."""
+        heartbeats = []
+        for (*fields, props), position in chunk:
+            heartbeat = HeartBeat(*fields)
+            if props is not None:
+                props = ProjectSettings(*props)
+                if position > self._read_back_to:
+                    heartbeat = heartbeat._replace(project_settings=props)
+                    heartbeats.extend(self._resolve_projects([heartbeat]))
+                    continue
+                heartbeat = self._with_project(heartbeat, props)
+            heartbeats.append(heartbeat)
+        self._read_back_to = max(self._read_back_to, chunk[-1][1])
+        return heartbeats
+
+    def buffer_stats(self) -> dict:
+        return self._buffer.stats()
 
     def shutdown(self):
-        self._stop()
-        self._queue.put_nowait(None)
+        # wakes up the worker thread immediately
+        self._buffer.close()
 
-    @property
-    def running(self):
-        with self._lock:
-            return self._running
+    def _past_deadline(self) -> bool:
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def stop(self) -> None:
+        """Send or spool the pending heartbeats within the shutdown deadline.
+
+        The worker thread spools the heartbeats left in the buffer
+        and sends what it can before the deadline; the rest is sent
+        by the next session. Whatever the worker could not take
+        in time is spooled by the calling thread."""
+        deadline = max(
+            settings.parse("shutdown_deadline", float, self.SHUTDOWN_DEADLINE), 0
+        )
+        self._deadline = time.monotonic() + deadline
+        self.shutdown()
+        if self.ident is None:
+            # the session ended before the worker was started
+            try:
+                self.start()
+            except RuntimeError:
+                # threads cannot be started while the interpreter exits
+                pass
+        if self.ident is not None:
+            self.join(max(self._deadline - time.monotonic(), 0))
+        # a worker still running past the deadline keeps the current roots
+        self._resolver.close()
+        left = self._buffer.drain()
+        if not left:
+            return
+        # the projects are resolved by the session that sends them
+        log(DEBUG, "Spooling {} heartbeats that were not taken in time", len(left))
+        try:
+            if self._spool is not None:
+                self._spool.append(left)
+            elif not self.is_alive():
+                spool = Spool(settings.SPOOL_DIR)
+                try:
+                    spool.append(left)
+                finally:
+                    spool.close()
+            else:
+                log(ERROR, "Lost {} heartbeats on shutdown", len(left))
+        except OSError as e:
+            log(ERROR, "Unable to spool heartbeats: {}", e)
+
+    def _user_agent(self) -> str:
+        blender_version = bpy.app.version_string.split()[0]
+        return f"blender/{blender_version} blender-wakatime/{self._version}"
+
+    def _transport(self) -> str:
+        transport = settings.get("transport", self.TRANSPORT_CLI)
+        if transport == self.TRANSPORT_HTTP:
+            if self._http.supported():
+                return transport
+            log(DEBUG, "The configured proxy requires the wakatime client")
+        elif transport == self.TRANSPORT_DAEMON:
+            if self._daemon.supported():
+                return transport
+            log(DEBUG, "The sender daemon requires Unix domain sockets")
+        return self.TRANSPORT_CLI
+
+    def _send_with_client(
+        self, heartbeat: HeartBeat, extra_heartbeats: List[HeartBeat]
+    ) -> Tuple[int, str]:
+        from .client_worker import client_argv
+
+        overwrite_project = WakatimeProjectProperties.snapshot().always_overwrite_name
+        argv = client_argv(
+            heartbeat.to_cli(overwrite_project),
+            self._user_agent(),
+            settings.debug(),
+            bool(extra_heartbeats),
+        )
+        log(DEBUG, " ".join(argv))
+        return self._client.send(argv, extra_heartbeats, overwrite_project)
 
-    def _stop(self):
-        with self._lock:
-            self._running = False
+    def _send_with_daemon(self, heartbeats: List[HeartBeat]) -> Tuple[int, str]:
+        overwrite_project = WakatimeProjectProperties.snapshot().always_overwrite_name
+        log(DEBUG, "Passing {} heartbeats to the sender daemon", len(heartbeats))
+        try:
+            return self._daemon.send(
+                heartbeats, self._user_agent(), overwrite_project, settings.debug()
+            )
+        except OSError as e:
+            log(WARNING, "Sender daemon is not available, sending directly: {}", e)
+        return self._send_with_client(heartbeats[0], heartbeats[1:])
 
     def _send_to_wakatime(
         self, heartbeat: HeartBeat, extra_heartbeats: Optional[List[HeartBeat]] = None
-    ):
-        ua = f"blender/{bpy.app.version_string.split()[0]} blender-wakatime/{self._version}"
-        cmd = [
-            sys.executable,
-            settings.API_CLIENT,
-            "--entity",
-            heartbeat.entity,
-            "--time",
-            f"{heartbeat.timestamp:f}",
-            "--plugin",
-            ua,
-        ]
-        props = WakatimeProjectProperties.instance()
-        if props and props.always_overwrite_name:
-            cmd.extend(["--project", heartbeat.project])
-        else:
-            cmd.extend(["--alternate-project", heartbeat.project])
-        if heartbeat.is_write:
-            cmd.append("--write")
-        if settings.debug():
-            cmd.append("--verbose")
-        if extra_heartbeats:
-            cmd.append("--extra-heartbeats")
-            stdin = PIPE
-        else:
-            stdin = None
-        log(DEBUG, " ".join(cmd))
+    ) -> bool:
         try:
-            process = Popen(cmd, stdin=stdin, stdout=PIPE, stderr=STDOUT)
-            inp = None
-            if extra_heartbeats:
-                inp = "{0}\n".format(
-                    json.dumps([hb.__dict__ for hb in extra_heartbeats])
+            start = time.perf_counter()
+            transport = self._transport()
+            heartbeats = [heartbeat, *(extra_heartbeats or ())]
+            if transport == self.TRANSPORT_HTTP:
+                log(DEBUG, "Posting {} heartbeats", len(heartbeats))
+                retcode, output = self._http.send(heartbeats, self._user_agent())
+            elif transport == self.TRANSPORT_DAEMON:
+                retcode, output = self._send_with_daemon(heartbeats)
+            else:
+                retcode, output = self._send_with_client(
+                    heartbeat, extra_heartbeats or []
                 )
-                inp = inp.encode("utf-8")
-            output, err = process.communicate(input=inp)
-            output = u(output)
-            retcode = process.poll()
-            if (not retcode or retcode == 102) and not output:
+            stats.send_latency_ms.add((time.perf_counter() - start) * 1000)
+            stats.return_codes[retcode] += 1
+            outcome = self._record_outcome(retcode)
+            if outcome in DELIVERED and outcome != REJECTED and not output:
                 log(DEBUG, "OK")
-            elif retcode == 104:  # wrong API key
+            elif retcode == CLIENT_AUTH_ERROR:  # wrong API key
                 log(ERROR, "Wrong API key. Asking for a new one...")
                 settings.set("api_key", "")
             else:
                 log(ERROR, "Error")
             if retcode:
                 log(
-                    DEBUG if retcode == 102 else ERROR,
+                    DEBUG if retcode == CLIENT_API_ERROR else ERROR,
                     "wakatime-core exited with status: {}",
                     retcode,
                 )
             if output:
                 log(ERROR, "wakatime-core output: {}", u(output))
+            # rejected heartbeats are dropped, sending them again would not help
+            return outcome in DELIVERED
         except Exception:
             log(ERROR, u(sys.exc_info()[1]))
+            self._record_outcome(None)
+        return False
 
-    def run(self):
-        while self.running:
-            time.sleep(self.POLL_INTERVAL)
-            if not settings.api_key():
-                continue
-            try:
-                heartbeat = self._queue.get_nowait()
-            except Empty:
-                continue
-            if heartbeat is None:
+    def _record_outcome(self, retcode: Optional[int]) -> str:
+        outcome = self._retry.record(retcode, settings.api_key())
+        if outcome in (SUCCESS, REJECTED):
+            return outcome
+        delay = self._retry.delay()
+        if delay is not None:
+            log(
+                WARNING,
+                "Sending heartbeats failed {} times in a row{}, "
+                "next attempt in {:.0f} s",
+                self._retry.failures,
+                " and the API is unreachable" if self._retry.circuit_open else "",
+                delay,
+            )
+        return outcome
+
+    def _chunks(self, items: Iterable) -> Iterator[list]:
+        """Split the items into lists small enough for a single client call"""
+        size = max(
+            settings.parse(
+                "max_heartbeats_per_send", int, self.MAX_HEARTBEATS_PER_SEND
+            ),
+            1,
+        )
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
                 return
-            extra_heartbeats = []
+            yield chunk
+
+    def _replay(self) -> None:
+        """Send the spooled heartbeats in chunks, oldest first.
+
+        Stops at the first failed chunk, which stays in the spool
+        and is retried when the retry scheduler allows it."""
+        if self._spool is None:
+            return
+        chunks = self._chunks(self._spool.pending())
+        # nothing is read from the spool while sending is not possible
+        while not self._past_deadline() and self._retry.ready(settings.api_key()):
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            heartbeats = self._read_back(chunk)
+            end = chunk[-1][1]
+            if not self._send_to_wakatime(heartbeats[0], heartbeats[1:]):
+                if not self._poisoned(end):
+                    return
+                log(
+                    ERROR,
+                    "Dropping {} spooled heartbeats, sending them failed {} times",
+                    len(chunk),
+                    self.MAX_CHUNK_ATTEMPTS,
+                )
+            self._spool.ack(end)
+
+    def _poisoned(self, end: SpoolPosition) -> bool:
+        """Whether the chunk that just failed keeps failing for its own sake.
+
+        Only failures of a client that ran while the API is reachable
+        count, so nothing is dropped while offline or without a client."""
+        if self._retry.outcome != FAILURE or self._retry.retcode in (
+            None,
+            ClientProcess.CRASHED,
+        ):
+            return False
+        position, attempts = self._failed_chunk
+        attempts = attempts + 1 if position == end else 1
+        self._failed_chunk = (end, attempts)
+        return attempts >= self.MAX_CHUNK_ATTEMPTS and self._http.reachable()
+
+    def _flush(self, pending: List[HeartBeat]) -> List[HeartBeat]:
+        """Spool and send the pending heartbeats.
+
+        Returns the heartbeats that have to be kept in memory for later."""
+        if self._spool is not None:
             try:
-                while True:
-                    extra = self._queue.get_nowait()
-                    if extra is None:
-                        self._stop()
-                        break
-                    extra_heartbeats.append(extra)
-            except Empty:
-                pass
-            self._send_to_wakatime(heartbeat, extra_heartbeats)
+                self._spool.append(pending)
+            except OSError as e:
+                log(ERROR, "Unable to spool heartbeats: {}", e)
+            else:
+                self._replay()
+                return []
+        unsent: List[HeartBeat] = []
+        for chunk in self._chunks(pending):
+            if (
+                unsent
+                or self._past_deadline()
+                or not self._retry.ready(settings.api_key())
+                or not self._send_to_wakatime(chunk[0], chunk[1:])
+            ):
+                unsent.extend(chunk)
+        return unsent
+
+    def run(self):
+        try:
+            self._spool = Spool(settings.SPOOL_DIR)
+            # the spools of the sessions that ended without sending everything
+            adopted = self._spool.adopt_orphans()
+            if adopted:
+                log(DEBUG, "Adopted {} heartbeat spools", adopted)
+        except OSError as e:
+            log(ERROR, "Unable to open heartbeat spool: {}", e)
+        try:
+            # send what was left from the previous sessions
+            self._replay()
+            self._process_queue()
+        finally:
+            self._client.close()
+            self._http.close()
+            self._daemon.close()
+            if self._spool is not None:
+                self._spool.close()
+            rollups.save()
+
+    def _flush_window(self) -> float:
+        return max(settings.parse("flush_window", float, self.FLUSH_WINDOW), 0)
+
+    def _report_buffer_losses(self, reported: tuple) -> tuple:
+        buffer = self._buffer
+        losses = buffer.merged, buffer.dropped, buffer.spilled
+        if losses != reported:
+            log(
+                DEBUG if not buffer.dropped else WARNING,
+                "Heartbeat buffer merged {}, dropped {}, spilled {} heartbeats",
+                *losses,
+            )
+        return losses
+
+    def _process_queue(self):
+        reported = (0, 0, 0)
+        while True:
+            # block until there is work, a retry is due or a shutdown request;
+            # without an API key, or with a rejected one, the heartbeats
+            # are kept until the next one arrives, instead of polling for a key
+            woken = self._buffer.wait(self._retry.delay(settings.api_key()))
+            pending, closed = self._buffer.get_batch(
+                self._flush_window() if woken else 0
+            )
+            reported = self._report_buffer_losses(reported)
+            if pending:
+                pending = self._resolve_projects(pending)
+                unsent = self._flush(pending)
+                if unsent:
+                    self._buffer.put_back(unsent)
+            else:
+                self._replay()
+            rollups.save_if_due()
+            if closed:
+                return
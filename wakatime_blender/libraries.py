@@ -0,0 +1,69 @@
+"""Libraries linked into the open file, for the "track_linked_libraries" option.
+
+With the option enabled, heartbeats of the open file are accompanied
+by heartbeats of the libraries in use, so that the time spent on a shot
+is also attributed to the projects of the assets being worked on.
+A library is in use when a selected object is linked from it, uses its
+data, overrides one of its objects or instances one of its collections.
+"""
+import os
+from typing import Dict, Iterator, Tuple
+
+import bpy
+from .log import DEBUG, log
+
+
+def _library_path(library) -> str:
+    # paths of nested libraries are relative to the library linking them
+    return os.path.normpath(bpy.path.abspath(library.filepath, library=library.parent))
+
+
+def _libraries_of(obj) -> Iterator:
+    yield obj.library
+    if obj.data is not None:
+        yield obj.data.library
+    override = getattr(obj, "override_library", None)
+    if override is not None and override.reference is not None:
+        yield override.reference.library
+    if obj.instance_collection is not None:
+        yield obj.instance_collection.library
+
+
+class LibraryIndex:
+    """Absolute paths of the linked libraries.
+
+    The index is built when a file is loaded. The paths are keyed by the
+    name and the relative path of the library, so a library that was
+    linked or relocated afterwards is resolved when it is first used.
+    Only the main thread uses the index.
+    """
+
+    def __init__(self) -> None:
+        # (library name, library filepath) -> absolute path
+        self._paths: Dict[Tuple[str, str], str] = {}
+
+    def clear(self) -> None:
+        self._paths.clear()
+
+    def build(self) -> None:
+        self.clear()
+        for library in bpy.data.libraries:
+            self.path(library)
+        log(DEBUG, "Indexed {} linked libraries", len(self._paths))
+
+    def path(self, library) -> str:
+        key = (library.name, library.filepath)
+        path = self._paths.get(key)
+        if path is None:
+            path = self._paths[key] = _library_path(library)
+        return path
+
+    def in_use(self) -> Tuple[str, ...]:
+        """Paths of the libraries used by the selected objects"""
+        selected = getattr(bpy.context, "selected_objects", None) or ()
+        paths = set()
+        for obj in selected:
+            for library in _libraries_of(obj):
+                if library is not None:
+                    paths.add(self.path(library))
+        return tuple(sorted(paths))
@@ -1,11 +1,129 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+import bpy
 from . import settings
 
-DEBUG = "DEBUG"
-INFO = "INFO"
-WARNING = "WARNING"
-ERROR = "ERROR"
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+_LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# how many recent records are kept in memory for the log dialog
+RING_SIZE = 1000
+# the log file written when the "log_to_file" option is enabled,
+# and how large it may grow before it is rotated
+LOG_FILE = os.path.join(settings.RESOURCES_DIR, "blender.log")
+LOG_FILE_SIZE = 1024 * 1024
+
+# (time, level, message, args, kwargs), formatted only when needed
+Record = Tuple[float, int, str, tuple, Dict[str, Any]]
+
+_records: Deque[Record] = deque(maxlen=RING_SIZE)
+_file_lock = threading.Lock()
+# derived from the options by _configure, so that log() does not
+# have to look anything up in the config
+_threshold = INFO
+_to_stdout = True
+_to_file = False
+
+
+def level_name(level: int) -> str:
+    return _LEVEL_NAMES.get(level, str(level))
+
+
+def _configure() -> None:
+    global _threshold, _to_stdout, _to_file
+    _threshold = DEBUG if settings.debug() else INFO
+    # printing stays enabled unless it is turned off explicitly
+    _to_stdout = settings.get("log_to_stdout") is None or settings.get_bool(
+        "log_to_stdout"
+    )
+    _to_file = settings.get_bool("log_to_file")
+
+
+def _format(record: Record) -> str:
+    _time, level, message, args, kwargs = record
+    if args or kwargs:
+        message = message.format(*args, **kwargs)
+    return f"[{level_name(level)}] {message}"
+
+
+def _write_file(record: Record, line: str) -> None:
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record[0]))
+    with _file_lock:
+        try:
+            if os.path.getsize(LOG_FILE) >= LOG_FILE_SIZE:
+                os.replace(LOG_FILE, f"{LOG_FILE}.1")
+        except OSError:
+            pass
+        try:
+            with open(LOG_FILE, "a", encoding="utf-8") as out:
+                out.write(f"{stamp} {line}\n")
+        except OSError:
+            pass
 
 
 def log(lvl, message, *args, **kwargs):
-    if lvl != DEBUG or settings.debug():
-        print(f"[Wakatime] [{lvl}] {message.format(*args, **kwargs)}")
+    """Record the message if its level passes the configured threshold.
+
+    The message is formatted with the arguments only when it is printed,
+    written to the log file or shown in the log dialog, so DEBUG
+    calls cost a single comparison unless debugging is enabled."""
+    if lvl < _threshold:
+        return
+    record = (time.time(), lvl, message, args, kwargs)
+    _records.append(record)
+    if _to_stdout or _to_file:
+        line = _format(record)
+        if _to_stdout:
+            print(f"[Wakatime] {line}")
+        if _to_file:
+            _write_file(record, line)
+
+
+def recent(count: int = RING_SIZE) -> list:
+    """The latest records as formatted lines, oldest first"""
+    lines = []
+    for record in list(_records)[-count:]:
+        stamp = time.strftime("%H:%M:%S", time.localtime(record[0]))
+        try:
+            line = _format(record)
+        except Exception as e:
+            line = f"[{level_name(record[1])}] {record[2]} ({e!r})"
+        lines.append(f"{stamp} {line}")
+    return lines
+
+
+settings.add_listener(_configure)
+_configure()
+
+
+class LogDialog(bpy.types.Operator):
+    bl_idname = "ui.wakatime_blender_log"
+    bl_label = "Wakatime Log"
+    bl_description = "Show the recent messages of the wakatime plugin"
+
+    # how many records fit into the dialog
+    LINES = 40
+
+    def execute(self, _context):
+        return {"FINISHED"}
+
+    def invoke(self, context, _event):
+        return context.window_manager.invoke_popup(self, width=800)
+
+    def draw(self, _context):
+        col = self.layout.column()
+        lines = recent(self.LINES)
+        if not lines:
+            col.label(text="Nothing was logged yet")
+        for line in lines:
+            col.label(text=line)
+        if _to_file:
+            col.label(text=f"Full log: {LOG_FILE}")
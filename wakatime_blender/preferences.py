@@ -1,13 +1,32 @@
-from typing import Optional
+from typing import NamedTuple, Optional
 
 import bpy
 from bpy.props import BoolProperty, FloatProperty, StringProperty
 from bpy_types import PropertyGroup
 from . import settings
-from .log import ERROR, log
+from .activity import gate
+from .log import DEBUG, log
 from .utils import u
 
 
+class ProjectSettings(NamedTuple):
+    """Immutable copy of WakatimeProjectProperties.
+
+    Hot paths and the worker thread read this instead of going through RNA.
+    """
+
+    always_overwrite_name: bool
+    use_project_folder: bool
+    truncate_trail: str
+    project_prefix: str
+    project_postfix: str
+    heartbeat_frequency: float
+
+
+def _update_snapshot(_self, _context) -> None:
+    WakatimeProjectProperties.refresh_snapshot()
+
+
 class WakatimeProjectProperties(PropertyGroup):
     _attr = "wakatime_preferences"
     bl_idname = "preferences.wakatime_preferences"
@@ -20,9 +39,20 @@ class WakatimeProjectProperties(PropertyGroup):
     _default_prefix = ""
     _default_postfix = ""
 
+    _default_snapshot = ProjectSettings(
+        always_overwrite_name=_default_always_overwrite_projectname,
+        use_project_folder=_default_use_project_folder,
+        truncate_trail=_default_chars,
+        project_prefix=_default_prefix,
+        project_postfix=_default_postfix,
+        heartbeat_frequency=_default_heartbeat_frequency,
+    )
+    _snapshot = _default_snapshot
+
     always_overwrite_name: BoolProperty(
         name="Overwrite project-discovery with the name from below",
         default=_default_always_overwrite_projectname,
+        update=_update_snapshot,
         description="Wakatime will guess the project-name (e.g. from the git-repo). Checking this box will overwrite "
         "this auto-discovered name (with the name according to the rules below).\n\nHint: when not "
         "working with git, the project's name will always be set according to the rules "
@@ -32,6 +62,7 @@ class WakatimeProjectProperties(PropertyGroup):
     use_project_folder: BoolProperty(
         name="Use folder-name as project-name",
         default=_default_use_project_folder,
+        update=_update_snapshot,
         description="Will use the name of the folder/directory-name as the project-name.\n\nExample: if selected, "
         "filename 'birthday_project/test_01.blend' will result in project-name "
         "'birthday_project'\n\nHint: if not activated, the blender-filename without the blend-extension "
@@ -41,6 +72,7 @@ class WakatimeProjectProperties(PropertyGroup):
     truncate_trail: StringProperty(
         name="Cut trailing characters",
         default=_default_chars,
+        update=_update_snapshot,
         description="With the project-name extracted (from folder- or filename), these trailing characters will be "
         "removed too.\n\nExample: filename 'birthday_01_test_02.blend' will result in project-name "
         "'birthday_01_test'",
@@ -49,11 +81,13 @@ class WakatimeProjectProperties(PropertyGroup):
     project_prefix: StringProperty(
         name="Project-name prefix",
         default=_default_prefix,
+        update=_update_snapshot,
         description="This text will be attached in front of the project-name.",
     )
     project_postfix: StringProperty(
         name="Project-name postfix",
         default=_default_postfix,
+        update=_update_snapshot,
         description="This text will be attached at the end of the project-name, after the trailing characters were "
         "removed.",
     )
@@ -64,6 +98,7 @@ class WakatimeProjectProperties(PropertyGroup):
         min=1,
         max=60,
         description="How often the plugin should send heartbeats to Wakatime server",
+        update=_update_snapshot,
     )
 
     @classmethod
@@ -95,9 +130,35 @@ class WakatimeProjectProperties(PropertyGroup):
             first_world = worlds[0]
             return getattr(first_world, cls._attr)
         except (IndexError, AttributeError, TypeError):
-            log(ERROR, "Unable to get WakatimeProjectProperties from the First World")
+            log(DEBUG, "Unable to get WakatimeProjectProperties from the First World")
         return None
 
+    @classmethod
+    def snapshot(cls) -> ProjectSettings:
+        return cls._snapshot
+
+    @classmethod
+    def refresh_snapshot(cls) -> ProjectSettings:
+        props = cls.instance()
+        if props is None:
+            snapshot = cls._default_snapshot._replace(
+                always_overwrite_name=settings.get_bool("always_overwrite_project_name")
+            )
+        else:
+            snapshot = ProjectSettings(
+                always_overwrite_name=props.always_overwrite_name,
+                use_project_folder=props.use_project_folder,
+                truncate_trail=props.truncate_trail,
+                project_prefix=props.project_prefix,
+                project_postfix=props.project_postfix,
+                heartbeat_frequency=props.heartbeat_frequency,
+            )
+        # the snapshot is replaced as a whole, so the worker thread
+        # always sees a consistent set of values
+        cls._snapshot = snapshot
+        gate.mark_dirty()
+        return snapshot
+
 
 class PreferencesDialog(bpy.types.Operator):
     bl_idname = "ui.wakatime_blender_preferences"
@@ -136,6 +197,7 @@ class PreferencesDialog(bpy.types.Operator):
             "always_overwrite_project_name", f"{self.always_overwrite_name_default}"
         )
         WakatimeProjectProperties.reload_defaults()
+        WakatimeProjectProperties.refresh_snapshot()
         self._hide()
         return {"FINISHED"}
 
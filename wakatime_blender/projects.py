@@ -0,0 +1,134 @@
+"""Project names of files from markers in the directories above them.
+
+Walking up from the directory of the file, the first of these wins:
+
+- a .wakatime-project file, as understood by the wakatime client:
+  its first line is the project name, or the name of its directory
+  if the line is empty;
+- a directory right below one of the studio roots, configured as the
+  comma separated "studio_roots" option, e.g. /studio/projects;
+- the root of a git, mercurial or subversion working copy.
+
+The results are cached per directory, so all the files of a directory
+share one lookup. A cached result is checked again after RECHECK_INTERVAL
+by comparing the modification times of the directories that were
+looked at, which change when a marker is created or removed.
+
+This module must not import bpy.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import settings
+
+MARKER = ".wakatime-project"
+VCS_DIRS = (".git", ".hg", ".svn")
+# seconds before a cached result is checked again
+RECHECK_INTERVAL = 10
+
+# (path, st_mtime_ns) of the directories and the marker that were looked at
+Stamps = Tuple[Tuple[str, int], ...]
+
+
+class Project(NamedTuple):
+    name: str
+    # named by a marker or a studio root; the client is told to use it,
+    # while it prefers its own detection of working copies
+    explicit: bool
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+def studio_roots() -> List[str]:
+    roots = settings.get("studio_roots", "")
+    return [
+        os.path.normcase(os.path.abspath(os.path.expanduser(root.strip())))
+        for root in roots.split(",")
+        if root.strip()
+    ]
+
+
+def _read_marker(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8") as inp:
+            return inp.readline().strip()
+    except (OSError, ValueError):
+        return ""
+
+
+class ProjectResolver:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # directory -> (checked at, stamps, project)
+        self._cache: Dict[str, Tuple[float, Stamps, Optional[Project]]] = {}
+        self._roots: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self.configure()
+        settings.add_listener(self.configure)
+
+    def close(self) -> None:
+        settings.remove_listener(self.configure)
+
+    def configure(self) -> None:
+        roots = studio_roots()
+        if roots != self._roots:
+            with self._lock:
+                self._roots = roots
+                self._cache.clear()
+
+    def _lookup(self, directory: str) -> Tuple[Stamps, Optional[Project]]:
+        stamps = []
+        roots = self._roots
+        path = directory
+        while True:
+            stamps.append((path, _mtime(path)))
+            marker = os.path.join(path, MARKER)
+            if os.path.isfile(marker):
+                stamps.append((marker, _mtime(marker)))
+                name = _read_marker(marker) or os.path.basename(path)
+                return tuple(stamps), Project(name, True)
+            parent = os.path.dirname(path)
+            if roots and os.path.normcase(parent) in roots:
+                return tuple(stamps), Project(os.path.basename(path), True)
+            if any(os.path.exists(os.path.join(path, vcs)) for vcs in VCS_DIRS):
+                return tuple(stamps), Project(os.path.basename(path), False)
+            if parent == path:
+                return tuple(stamps), None
+            path = parent
+
+    def resolve(self, filename: str) -> Optional[Project]:
+        """The project of the file, None if no marker was found"""
+        directory = os.path.dirname(os.path.abspath(filename))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(directory)
+        if cached is not None:
+            checked_at, stamps, project = cached
+            if now - checked_at < RECHECK_INTERVAL:
+                self.hits += 1
+                return project
+            if all(_mtime(path) == mtime for path, mtime in stamps):
+                self.hits += 1
+                with self._lock:
+                    self._cache[directory] = (now, stamps, project)
+                return project
+        self.misses += 1
+        stamps, project = self._lookup(directory)
+        with self._lock:
+            self._cache[directory] = (now, stamps, project)
+        return project
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "directories": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
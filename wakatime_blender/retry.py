@@ -0,0 +1,149 @@
+"""When to try sending heartbeats again after the client or the API failed.
+
+This module must not import bpy.
+"""
+import random
+import time
+from typing import Callable, Dict, Optional
+
+# return codes of the wakatime clients, the legacy python client
+# and wakatime-cli, that are not treated as failures
+CLIENT_SUCCESS = 0
+# the API is unreachable, the client queued the heartbeats itself
+CLIENT_API_ERROR = 102
+CLIENT_AUTH_ERROR = 104
+# the legacy client rejected a heartbeat as malformed
+CLIENT_MALFORMED_HEARTBEAT = 106
+# wakatime-cli is backing off and queued the heartbeats itself
+CLIENT_BACKOFF = 112
+# return codes of the add-on's own transports, out of the range
+# of process exit codes, so that they never mean anything else
+UNREACHABLE_CODE = 1001
+REJECTED_CODE = 1002
+
+# how the return codes are treated
+SUCCESS = "success"
+# the client queued the heartbeats itself, because the API is unreachable
+OFFLINE = "offline"
+# the API could not be reached, the heartbeats were not sent
+UNREACHABLE = "unreachable"
+AUTH_ERROR = "auth_error"
+# the heartbeats were rejected for good; they are dropped, not retried
+REJECTED = "rejected"
+FAILURE = "failure"
+
+_OUTCOMES = {
+    CLIENT_SUCCESS: SUCCESS,
+    CLIENT_API_ERROR: OFFLINE,
+    CLIENT_BACKOFF: OFFLINE,
+    CLIENT_AUTH_ERROR: AUTH_ERROR,
+    CLIENT_MALFORMED_HEARTBEAT: REJECTED,
+    UNREACHABLE_CODE: UNREACHABLE,
+    REJECTED_CODE: REJECTED,
+}
+# the heartbeats need not be sent again
+DELIVERED = (SUCCESS, OFFLINE, REJECTED)
+
+
+def classify(retcode: Optional[int]) -> str:
+    """None means that the client could not be run at all"""
+    return _OUTCOMES.get(retcode, FAILURE)
+
+
+class RetryScheduler:
+    """Exponential backoff with jitter and a circuit breaker.
+
+    After each failed send the next attempt is delayed twice as long,
+    up to max_delay. After circuit_threshold failures in a row the circuit
+    opens, and no heartbeats are sent until the probe, which should be
+    much cheaper than a send, succeeds. A rejected API key pauses sending
+    until the key changes.
+
+    Only the worker thread uses the scheduler, so it is not locked.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], bool],
+        base_delay: float = 5,
+        max_delay: float = 600,
+        circuit_threshold: int = 5,
+    ) -> None:
+        self._probe = probe
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._circuit_threshold = circuit_threshold
+        self.failures = 0
+        self._next_attempt = 0.0
+        self._paused_key: Optional[str] = None
+        # of the latest send
+        self.retcode: Optional[int] = None
+        self.outcome = SUCCESS
+        self.probes = 0
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.failures >= self._circuit_threshold
+
+    def record(self, retcode: Optional[int], api_key: str) -> str:
+        """Update the schedule with the outcome of a send, returns its class"""
+        self.retcode = retcode
+        outcome = self.outcome = classify(retcode)
+        # a rejected batch was delivered, the API is reachable
+        if outcome in (SUCCESS, REJECTED):
+            self.failures = 0
+            self._next_attempt = 0.0
+        elif outcome == AUTH_ERROR:
+            self._paused_key = api_key
+        else:
+            self.failures += 1
+            self._schedule()
+        return outcome
+
+    def _schedule(self) -> None:
+        delay = min(self._base_delay * 2 ** (self.failures - 1), self._max_delay)
+        # "equal jitter", so that Blender instances that lost the network
+        # at the same time do not retry in lockstep
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self._next_attempt = time.monotonic() + delay
+
+    def waiting_for_key(self, api_key: str) -> bool:
+        """Whether sending has to wait for a new API key"""
+        return not api_key or api_key == self._paused_key
+
+    def delay(self, api_key: Optional[str] = None) -> Optional[float]:
+        """Seconds until the next attempt, None if nothing has to be retried.
+
+        With the API key, also None while sending waits for a new key,
+        which no timer can bring about."""
+        if not self.failures:
+            return None
+        if api_key is not None and self.waiting_for_key(api_key):
+            return None
+        return max(self._next_attempt - time.monotonic(), 0)
+
+    def ready(self, api_key: str) -> bool:
+        """Whether heartbeats may be sent now"""
+        if self.waiting_for_key(api_key):
+            return False
+        self._paused_key = None
+        if self.failures and time.monotonic() < self._next_attempt:
+            return False
+        if self.circuit_open:
+            self.probes += 1
+            if not self._probe():
+                self.failures += 1
+                self._schedule()
+                return False
+            # half-open: a single send decides whether the circuit closes
+        return True
+
+    def stats(self) -> Dict[str, object]:
+        delay = self.delay()
+        return {
+            "failures": self.failures,
+            "circuit_open": self.circuit_open,
+            "paused_for_api_key": self._paused_key is not None,
+            "probes": self.probes,
+            "next_attempt_s": round(delay, 1) if delay is not None else None,
+        }
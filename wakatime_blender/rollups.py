@@ -0,0 +1,256 @@
+"""Local time per project and per file, for the report in the Wakatime menu.
+
+The durations are computed from the heartbeats as wakatime.com does:
+the time between two consecutive heartbeats is attributed to the
+project and the file of the first one, unless they are more than
+TIMEOUT apart. The totals are kept per day in small JSON files in
+ROLLUP_DIR, so a report only reads the files of the days it covers.
+
+Several Blender instances add their own totals to the same files;
+each instance only ever adds the durations it computed since its last
+save, while holding the lock file of the directory, so that no totals
+are lost when two instances save the same day at the same moment.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import bpy
+from . import settings
+from .log import ERROR, log
+from .utils import lock_file
+
+ROLLUP_DIR = os.path.join(settings.RESOURCES_DIR, "blender-rollups")
+# heartbeats further apart end the duration, seconds
+TIMEOUT = 15 * 60
+# how often the pending totals are written, seconds
+SAVE_INTERVAL = 60
+
+_LOCK_FILE = "lock"
+
+PROJECTS = "projects"
+FILES = "files"
+
+# "projects" or "files" -> name -> seconds
+Totals = Dict[str, Dict[str, float]]
+
+
+def day_of(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+def _next_midnight(timestamp: float) -> float:
+    t = time.localtime(timestamp)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+
+def _new_totals() -> Totals:
+    return {PROJECTS: {}, FILES: {}}
+
+
+def _add(totals: Totals, other: Totals) -> None:
+    for kind, values in other.items():
+        target = totals.setdefault(kind, {})
+        for name, seconds in values.items():
+            target[name] = target.get(name, 0.0) + seconds
+
+
+class Rollups:
+    """Per-day totals of the heartbeats that were produced.
+
+    add() is called for every new heartbeat once its project is known
+    and only appends it to a deque; the durations are computed when the
+    worker thread saves the totals or when a report is requested.
+    """
+
+    def __init__(self, directory: str = ROLLUP_DIR, timeout: float = TIMEOUT):
+        self.directory = directory
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # (timestamp, project, entity) of the heartbeats not counted yet
+        self._new: Deque[Tuple[float, str, str]] = deque()
+        # the latest heartbeat that was counted
+        self._last: Optional[Tuple[float, str, str]] = None
+        # day -> totals that were not written yet
+        self._pending: Dict[str, Totals] = {}
+        self._saved_at = time.monotonic()
+        # (start, end, name) of the day of the latest duration
+        self._day = (0.0, 0.0, "")
+        # day -> (mtime and size of the file, totals), for the report
+        self._cache: Dict[str, Tuple[Tuple[int, int], Totals]] = {}
+
+    def add(self, timestamp: float, project: str, entity: str) -> None:
+        self._new.append((timestamp, project, entity))
+
+    def _count(self) -> None:
+        """Add the durations between the new heartbeats to the pending totals"""
+        new = self._new
+        while new:
+            last, self._last = self._last, new.popleft()
+            if last is None:
+                continue
+            # the time since the previous heartbeat is spent on its file
+            start, project, entity = last
+            timestamp = self._last[0]
+            if not 0 < timestamp - start <= self._timeout:
+                continue
+            # the part after midnight belongs to the next day
+            while start < timestamp:
+                day_start, day_end, day = self._day
+                if not day_start <= start < day_end:
+                    day_end = _next_midnight(start)
+                    day = day_of(start)
+                    self._day = (start, day_end, day)
+                end = min(day_end, timestamp)
+                totals = self._pending.setdefault(day, _new_totals())
+                projects, files = totals[PROJECTS], totals[FILES]
+                projects[project] = projects.get(project, 0.0) + end - start
+                files[entity] = files.get(entity, 0.0) + end - start
+                start = end
+
+    def _path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.json")
+
+    def _read(self, day: str, use_cache: bool = True) -> Totals:
+        import json
+
+        path = self._path(day)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return _new_totals()
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._cache.get(day)
+        if use_cache and cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            with open(path, encoding="utf-8") as inp:
+                totals = json.load(inp)
+        except (OSError, ValueError) as e:
+            log(ERROR, "Unable to read {}: {}", path, e)
+            return _new_totals()
+        self._cache[day] = (key, totals)
+        return totals
+
+    def _write(self, day: str, totals: Totals) -> None:
+        import json
+
+        path = self._path(day)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            json.dump(totals, out, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def save(self) -> None:
+        """Add the pending totals to the files of their days"""
+        with self._lock:
+            self._count()
+            pending, self._pending = self._pending, {}
+            self._saved_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            lock = open(os.path.join(self.directory, _LOCK_FILE), "ab")
+        except OSError as e:
+            log(ERROR, "Unable to lock {}: {}", self.directory, e)
+            self._keep(pending)
+            return
+        with lock:
+            if not lock_file(lock):
+                log(ERROR, "Unable to lock {}", self.directory)
+                self._keep(pending)
+                return
+            for day, delta in pending.items():
+                totals = _new_totals()
+                # the file may have been saved by another instance
+                # within the resolution of its modification time
+                _add(totals, self._read(day, use_cache=False))
+                _add(totals, delta)
+                try:
+                    self._write(day, totals)
+                except OSError as e:
+                    log(ERROR, "Unable to save the time of {}: {}", day, e)
+                    self._keep({day: delta})
+
+    def _keep(self, pending: Dict[str, Totals]) -> None:
+        """Save the totals with the next ones"""
+        with self._lock:
+            for day, delta in pending.items():
+                _add(self._pending.setdefault(day, _new_totals()), delta)
+
+    def save_if_due(self) -> None:
+        due = time.monotonic() - self._saved_at >= SAVE_INTERVAL
+        if due and (self._new or self._pending):
+            self.save()
+
+    def totals(self, days: Iterable[str]) -> Totals:
+        """The time spent in the days, including what was not saved yet"""
+        totals = _new_totals()
+        with self._lock:
+            self._count()
+            pending = {day: self._pending.get(day) for day in days}
+        for day, delta in pending.items():
+            _add(totals, self._read(day))
+            if delta:
+                _add(totals, delta)
+        return totals
+
+    def report(self, now: Optional[float] = None) -> Dict[str, Totals]:
+        """Totals of today, of this week since Monday and of this month"""
+        now = time.time() if now is None else now
+        today = time.localtime(now)
+        # today first; the week may start in the previous month
+        year, month, day = today.tm_year, today.tm_mon, today.tm_mday
+        days = [
+            # noon, so that the days are not shifted by daylight saving time
+            day_of(time.mktime((year, month, day - offset, 12, 0, 0, 0, 0, -1)))
+            for offset in range(max(day, today.tm_wday + 1))
+        ]
+        return {
+            "Today": self.totals(days[:1]),
+            "This week": self.totals(days[: today.tm_wday + 1]),
+            "This month": self.totals(days[: today.tm_mday]),
+        }
+
+
+rollups = Rollups()
+
+
+def _duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"{minutes // 60} h {minutes % 60:02d} min"
+
+
+def _top(values: Dict[str, float], count: int) -> List[Tuple[str, float]]:
+    return sorted(values.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+class ReportDialog(bpy.types.Operator):
+    bl_idname = "ui.wakatime_blender_report"
+    bl_label = "Wakatime Time Report"
+    bl_description = "Show the time spent per project and file, computed locally"
+
+    # how many projects and files are listed per period
+    TOP = 5
+
+    def execute(self, _context):
+        return {"FINISHED"}
+
+    def invoke(self, context, _event):
+        return context.window_manager.invoke_popup(self, width=600)
+
+    def draw(self, _context):
+        col = self.layout.column()
+        for period, totals in rollups.report().items():
+            projects = totals[PROJECTS]
+            col.label(text=f"{period}: {_duration(sum(projects.values()))}")
+            for project, seconds in _top(projects, self.TOP):
+                col.label(text=f"    {project or '-'}: {_duration(seconds)}")
+            if period == "Today" and totals[FILES]:
+                col.label(text="    Files:")
+                for entity, seconds in _top(totals[FILES], self.TOP):
+                    name = os.path.basename(entity) or entity
+                    col.label(text=f"        {name}: {_duration(seconds)}")
@@ -0,0 +1,184 @@
+"""Per-user daemon that sends the heartbeats of all Blender instances.
+
+The script is started with Blender's python by the first HeartbeatQueue
+that needs it, when the "transport" option is "daemon":
+
+    python sender_daemon.py <socket path> [idle timeout]
+
+It listens on a Unix domain socket and imports the client once
+for all instances, so the cost of sending does not grow with
+the number of Blender sessions. Requests that arrive while the client
+is busy are merged into a single client call, and the heartbeats
+sent by several instances at once are deduplicated.
+
+Each request is a JSON header line {"client": <path to cli.py>,
+"plugin": str, "overwrite_project": bool, "verbose": bool, "heartbeats": n}
+followed by n lines of heartbeats as produced by HeartBeat.to_cli().
+The response is a single JSON line {"retcode": int, "output": str},
+written after the heartbeats were passed to the client.
+
+Only one daemon runs at a time, guarded by a lock file next to the socket.
+It exits when no instance has been connected for the idle timeout,
+IDLE_TIMEOUT seconds by default.
+
+This module must not import bpy or anything from the add-on,
+except for client_worker.py.
+"""
+import fcntl
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from client_worker import Entry, client_argv, execute, load_client
+
+# how long to keep running without connected instances, seconds
+IDLE_TIMEOUT = 10 * 60
+
+
+class Request:
+    """Heartbeats of one instance waiting to be sent"""
+
+    __slots__ = ("key", "heartbeats", "done", "result")
+
+    def __init__(self, header: dict, heartbeats: List[dict]) -> None:
+        # requests with the same key can be sent with a single client call
+        self.key = (
+            header["client"],
+            header["plugin"],
+            header["overwrite_project"],
+            header["verbose"],
+        )
+        self.heartbeats = heartbeats
+        self.done = threading.Event()
+        self.result: Tuple[int, str] = (1, "")
+
+
+class SenderDaemon:
+    def __init__(self, server: socket.socket, idle_timeout: float) -> None:
+        self._server = server
+        self._idle_timeout = idle_timeout
+        self._requests: "queue.Queue[Request]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._client_path = ""
+        self._entry: Optional[Entry] = None
+
+    def _serve(self, connection: socket.socket) -> None:
+        with self._lock:
+            self._connections += 1
+        try:
+            with connection, connection.makefile("rwb") as stream:
+                for line in stream:
+                    header = json.loads(line)
+                    heartbeats = [
+                        json.loads(stream.readline())
+                        for _ in range(header["heartbeats"])
+                    ]
+                    request = Request(header, heartbeats)
+                    self._requests.put(request)
+                    request.done.wait()
+                    retcode, output = request.result
+                    response = {"retcode": retcode, "output": output}
+                    stream.write(f"{json.dumps(response)}\n".encode("utf-8"))
+                    stream.flush()
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            with self._lock:
+                self._connections -= 1
+
+    def _accept(self) -> None:
+        while True:
+            connection, _ = self._server.accept()
+            thread = threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            )
+            thread.start()
+
+    def _load(self, client_path: str) -> Entry:
+        if self._entry is None or client_path != self._client_path:
+            # a new client version was installed
+            self._entry = load_client(client_path)
+            self._client_path = client_path
+        return self._entry
+
+    def _send(self, requests: List[Request]) -> Tuple[int, str]:
+        client_path, plugin, _, verbose = requests[0].key
+        seen = set()
+        heartbeats = []
+        for request in requests:
+            for hb in request.heartbeats:
+                key = (hb["entity"], hb["time"], hb["is_write"])
+                if key not in seen:
+                    seen.add(key)
+                    heartbeats.append(hb)
+        try:
+            entry = self._load(client_path)
+        except Exception:
+            self._entry = None
+            return 1, traceback.format_exc()
+        first, extra = heartbeats[0], heartbeats[1:]
+        argv = client_argv(first, plugin, verbose, bool(extra))
+        stdin = f"{json.dumps(extra)}\n" if extra else ""
+        return execute(entry, argv, stdin)
+
+    def run(self) -> None:
+        threading.Thread(target=self._accept, daemon=True).start()
+        while True:
+            try:
+                requests = [self._requests.get(timeout=self._idle_timeout)]
+            except queue.Empty:
+                with self._lock:
+                    if not self._connections:
+                        return
+                continue
+            # merge everything that arrived while the client was busy
+            while True:
+                try:
+                    requests.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            groups: Dict[tuple, List[Request]] = {}
+            for request in requests:
+                groups.setdefault(request.key, []).append(request)
+            for group in groups.values():
+                result = self._send(group)
+                for request in group:
+                    request.result = result
+                    request.done.set()
+
+
+def main() -> int:
+    socket_path = sys.argv[1]
+    idle_timeout = float(sys.argv[2]) if len(sys.argv) > 2 else IDLE_TIMEOUT
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    lock = open(f"{socket_path}.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        # another daemon is running already
+        return 0
+    # the socket is left behind by a daemon that was killed
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    try:
+        SenderDaemon(server, idle_timeout).run()
+    finally:
+        # stop accepting connections before releasing the lock
+        os.remove(socket_path)
+        server.close()
+        lock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
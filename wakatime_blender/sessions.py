@@ -0,0 +1,65 @@
+"""Render jobs and animation playback, sent as a few heartbeats each.
+
+While Blender renders or plays the animation back, depsgraph_update_pre
+fires for every frame, but nobody is editing. From the start to the end
+of such a session the activity gate stays closed, so the events cost no
+more than the gate check, and the time of the session is sent as one
+heartbeat when it starts and a few more when it ends, spread evenly
+over its duration at most SPACING apart, however many frames it had.
+
+This module must not import bpy.
+"""
+import math
+from typing import Dict, List, NamedTuple, Optional
+
+RENDER = "render"
+PLAYBACK = "playback"
+
+# heartbeats of a session are at most this far apart, seconds;
+# wakatime, like the local rollups, only joins heartbeats that are
+# less than 15 minutes apart into one duration
+SPACING = 10 * 60
+
+
+class Session(NamedTuple):
+    filename: str
+    category: str
+    start: float
+
+
+class FinishedSession(NamedTuple):
+    filename: str
+    category: str
+    # of the heartbeats after the first one
+    timestamps: List[float]
+
+
+class SessionTracker:
+    """The running sessions, at most one of each kind.
+
+    Handlers of render jobs may run in the render thread,
+    but they only replace items of the dict."""
+
+    def __init__(self) -> None:
+        self._sessions: Dict[str, Session] = {}
+
+    def active(self) -> bool:
+        return bool(self._sessions)
+
+    def start(self, kind: str, filename: str, category: str, timestamp: float) -> None:
+        self._sessions[kind] = Session(filename, category, timestamp)
+
+    def finish(self, kind: str, timestamp: float) -> Optional[FinishedSession]:
+        session = self._sessions.pop(kind, None)
+        if session is None:
+            return None
+        duration = max(timestamp - session.start, 0)
+        count = max(math.ceil(duration / SPACING), 1)
+        return FinishedSession(
+            session.filename,
+            session.category,
+            [session.start + duration * (i + 1) / count for i in range(count)],
+        )
+
+    def kinds(self) -> List[str]:
+        return list(self._sessions)
@@ -1,55 +1,170 @@
 import os
+import shutil
+import tempfile
+import threading
 from configparser import ConfigParser
-from typing import Any, Callable, Optional, TypeVar
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
 USER_HOME = os.path.expanduser("~")
 PLUGIN_DIR = os.path.dirname(os.path.realpath(__file__))
 RESOURCES_DIR = os.path.join(USER_HOME, ".wakatime")
 API_CLIENT_DIR = os.path.join(RESOURCES_DIR, "wakatime-runtime")
+# heartbeats that were not sent yet
+SPOOL_DIR = os.path.join(RESOURCES_DIR, "blender-spool")
+# socket of the sender daemon shared by all Blender instances of the user
+SENDER_SOCKET = os.path.join(RESOURCES_DIR, "blender-sender.sock")
 # using the legacy python client to avoid the need to figure out
 # which binary to download for particular platform
 API_CLIENT_URL = "https://github.com/wakatime/wakatime/archive/master.zip"
-API_CLIENT = os.path.join(
-    API_CLIENT_DIR, "legacy-python-cli-master", "wakatime", "cli.py"
-)
+# location of cli.py inside the runtime directory
+API_CLIENT_RELPATH = os.path.join("legacy-python-cli-master", "wakatime", "cli.py")
+# the client installed by the older versions of the plugin
+API_CLIENT = os.path.join(API_CLIENT_DIR, API_CLIENT_RELPATH)
+# downloaded client versions, each is laid out like API_CLIENT_DIR
+API_CLIENT_VERSIONS_DIR = os.path.join(RESOURCES_DIR, "wakatime-runtime-versions")
+# contains the name of the version in API_CLIENT_VERSIONS_DIR that is in use
+API_CLIENT_ACTIVE = os.path.join(RESOURCES_DIR, "wakatime-runtime.active")
+# held by the Blender instance that downloads, installs or removes client versions
+API_CLIENT_LOCK = os.path.join(RESOURCES_DIR, "wakatime-runtime.lock")
 # default wakatime config for legacy python client
 FILENAME = os.path.join(USER_HOME, ".wakatime.cfg")
 # default section in wakatime config
 _section = "settings"
 
+# how often to check the config file for changes made by other programs, seconds
+RELOAD_INTERVAL = 5
+# how long to wait for more changes before writing them to the config file
+WRITE_DELAY = 0.5
+
+_lock = threading.RLock()
 _cfg = ConfigParser()
-_cfg.optionxform = str
-if not _cfg.has_section(_section):
-    _cfg.add_section(_section)
-if not _cfg.has_option(_section, "debug"):
-    _cfg.set(_section, "debug", str(False))
+# the options of the default section, cached for fast lookups
+_values: Dict[str, str] = {}
+# (mtime, size) of the config file when it was last read or written,
+# None if there was no config file
+_NOT_LOADED = (-1, -1)
+_file_state: Optional[Tuple[int, int]] = _NOT_LOADED
+_next_check = 0.0
+# changes that were not written to the config file yet
+_pending: Dict[str, str] = {}
+_write_timer: Optional[threading.Timer] = None
+# called whenever the cached options may have changed
+_listeners: List[Callable[[], None]] = []
+
+
+def _stat() -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(FILENAME)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
 
-_loaded = False
+def _new_config() -> ConfigParser:
+    cfg = ConfigParser()
+    cfg.optionxform = str
+    cfg.add_section(_section)
+    cfg.set(_section, "debug", str(False))
+    return cfg
 
 
 def load():
-    global _loaded
+    """(Re)read the config file, keeping the changes that were not written yet"""
+    global _cfg, _values, _file_state
+    with _lock:
+        cfg = _new_config()
+        state = _stat()
+        try:
+            cfg.read(FILENAME, "utf-8")
+        except Exception as e:
+            print(f"[Wakatime] [ERROR] Unable to read {FILENAME}\n{repr(e)}")
+        for option, value in _pending.items():
+            cfg.set(_section, option, value)
+        _cfg = cfg
+        _values = dict(cfg.items(_section, raw=True))
+        _file_state = state
+        _notify()
+
+
+def add_listener(listener: Callable[[], None]) -> None:
+    """Call the listener whenever the options may have changed,
+    for things derived from them that are too costly to compute on every use"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[], None]) -> None:
     try:
-        _cfg.read(FILENAME, "utf-8")
-        _loaded = True
-    except Exception as e:
-        print(f"[Wakatime] [ERROR] Unable to read {FILENAME}\n{repr(e)}")
+        _listeners.remove(listener)
+    except ValueError:
+        pass
+
+
+def _notify() -> None:
+    for listener in tuple(_listeners):
+        listener()
+
+
+def _check_reload() -> None:
+    global _next_check
+    with _lock:
+        _next_check = monotonic() + RELOAD_INTERVAL
+        if _stat() != _file_state:
+            load()
 
 
 def save():
-    with open(FILENAME, "w") as out:
-        _cfg.write(out)
+    """Write the pending changes to the config file right away.
+
+    The file is replaced atomically, so other programs and Blender
+    sessions never see it half-written."""
+    global _file_state, _write_timer
+    with _lock:
+        if _write_timer is not None:
+            _write_timer.cancel()
+            _write_timer = None
+        if not _pending:
+            return
+        # merge the changes made to the file by others
+        if _stat() != _file_state:
+            load()
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=".wakatime.cfg.", dir=os.path.dirname(FILENAME)
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                _cfg.write(out)
+            if os.path.exists(FILENAME):
+                shutil.copymode(FILENAME, tmp_path)
+            os.replace(tmp_path, FILENAME)
+        except OSError as e:
+            print(f"[Wakatime] [ERROR] Unable to write {FILENAME}\n{repr(e)}")
+            return
+        _pending.clear()
+        _file_state = _stat()
 
 
 def set(option: str, value: str) -> None:
-    _cfg.set(_section, option, value)
-    save()
+    """Change the option; the changes made in quick succession
+    are written to the config file together."""
+    global _write_timer
+    with _lock:
+        if _file_state == _NOT_LOADED:
+            load()
+        _pending[option] = value
+        _cfg.set(_section, option, value)
+        _values[option] = value
+        if _write_timer is None:
+            _write_timer = threading.Timer(WRITE_DELAY, save)
+            _write_timer.daemon = True
+            _write_timer.start()
+        _notify()
 
 
 def get(option: str, default: Any = None) -> str:
-    if not _loaded:
-        load()
-    return _cfg.get(_section, option, fallback=default)
+    if monotonic() >= _next_check:
+        _check_reload()
+    return _values.get(option, default)
 
 
 def get_bool(option: str) -> bool:
@@ -78,3 +193,33 @@ def api_key() -> str:
 
 def set_api_key(new_key: str) -> None:
     set("api_key", new_key)
+
+
+def active_api_client_version() -> str:
+    try:
+        with open(API_CLIENT_ACTIVE, encoding="utf-8") as inp:
+            return inp.read().strip()
+    except OSError:
+        return ""
+
+
+def api_client() -> str:
+    """Path to cli.py of the active client version.
+
+    Falls back to API_CLIENT if no version was activated yet."""
+    version = active_api_client_version()
+    if version:
+        path = os.path.join(API_CLIENT_VERSIONS_DIR, version, API_CLIENT_RELPATH)
+        if os.path.isfile(path):
+            return path
+    return API_CLIENT
+
+
+def activate_api_client_version(version: str) -> None:
+    """Atomically switch the client version used for the new client processes"""
+    tmp_path = f"{API_CLIENT_ACTIVE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        out.write(version)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, API_CLIENT_ACTIVE)
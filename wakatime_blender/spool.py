@@ -0,0 +1,384 @@
+"""Durable on-disk queue of heartbeats that were not yet sent.
+
+Heartbeats are appended to segment files as compact binary records.
+The position of the first record that was not acknowledged yet
+is kept in a separate cursor file, so that reading the backlog
+never requires loading it into memory, and segments that were
+sent completely are simply removed. Each Blender instance has a
+spool of its own, in a subdirectory of the spool directory.
+
+This module must not import bpy.
+"""
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .utils import lock_file
+
+# crc32 of the rest of the record
+_CRC = struct.Struct("<I")
+# timestamp, flags, entity and project lengths,
+# followed by utf-8 encoded entity and project
+_BODY = struct.Struct("<dBHH")
+# with _FLAG_CATEGORY, the length of the utf-8 encoded category
+# that follows the project
+_CATEGORY_LENGTH = struct.Struct("<B")
+# with _FLAG_SETTINGS, the project settings of a heartbeat that was
+# spilled before its project was resolved: heartbeat frequency, option
+# flags and the lengths of the utf-8 encoded truncate trail, prefix and
+# postfix, which follow
+_SETTINGS = struct.Struct("<dBHHH")
+_CURSOR = struct.Struct("<QQ")
+_FLAG_WRITE = 1
+_FLAG_CATEGORY = 2
+_FLAG_SETTINGS = 4
+_FLAG_EXPLICIT_PROJECT = 8
+_OPTION_OVERWRITE_NAME = 1
+_OPTION_PROJECT_FOLDER = 2
+
+_SEGMENT_SUFFIX = ".seg"
+_CURSOR_FILE = "cursor"
+_LOCK_FILE = "lock"
+
+# (always_overwrite_name, use_project_folder, truncate_trail,
+#  project_prefix, project_postfix, heartbeat_frequency)
+Settings = Tuple[bool, bool, str, str, str, float]
+# (entity, project, timestamp, is_write, category, explicit_project, settings)
+Record = Tuple[str, str, float, bool, str, bool, Optional[Settings]]
+
+
+class SpoolPosition(NamedTuple):
+    segment: int
+    offset: int
+
+
+def encode(heartbeat) -> bytes:
+    entity = heartbeat.entity.encode("utf-8")
+    project = heartbeat.project.encode("utf-8")
+    # records without a category are written as before
+    category = heartbeat.category.encode("utf-8")[:255]
+    flags = _FLAG_WRITE if heartbeat.is_write else 0
+    if category:
+        flags |= _FLAG_CATEGORY
+    if heartbeat.project_settings is not None:
+        flags |= _FLAG_SETTINGS
+    if heartbeat.explicit_project:
+        flags |= _FLAG_EXPLICIT_PROJECT
+    body = (
+        _BODY.pack(heartbeat.timestamp, flags, len(entity), len(project))
+        + entity
+        + project
+    )
+    if category:
+        body += _CATEGORY_LENGTH.pack(len(category)) + category
+    if heartbeat.project_settings is not None:
+        body += _encode_settings(heartbeat.project_settings)
+    return _CRC.pack(zlib.crc32(body)) + body
+
+
+def _encode_settings(settings) -> bytes:
+    options = (_OPTION_OVERWRITE_NAME if settings.always_overwrite_name else 0) | (
+        _OPTION_PROJECT_FOLDER if settings.use_project_folder else 0
+    )
+    strings = [
+        value.encode("utf-8")[:0xFFFF]
+        for value in (
+            settings.truncate_trail,
+            settings.project_prefix,
+            settings.project_postfix,
+        )
+    ]
+    return _SETTINGS.pack(
+        settings.heartbeat_frequency, options, *map(len, strings)
+    ) + b"".join(strings)
+
+
+def _read_settings(stream) -> Optional[Tuple[bytes, Settings]]:
+    """Returns the raw bytes, for the crc, and the settings"""
+    header = stream.read(_SETTINGS.size)
+    if len(header) < _SETTINGS.size:
+        return None
+    frequency, options, *lengths = _SETTINGS.unpack(header)
+    strings = stream.read(sum(lengths))
+    if len(strings) < sum(lengths):
+        return None
+    values = []
+    start = 0
+    for length in lengths:
+        # a string cut at the length limit may end in a partial character
+        values.append(strings[start : start + length].decode("utf-8", "ignore"))
+        start += length
+    settings = (
+        bool(options & _OPTION_OVERWRITE_NAME),
+        bool(options & _OPTION_PROJECT_FOLDER),
+        *values,
+        frequency,
+    )
+    return header + strings, settings
+
+
+def _read_record(stream) -> Optional[Record]:
+    """Returns None at the end of the stream or at a torn record."""
+    header = stream.read(_CRC.size + _BODY.size)
+    if len(header) < _CRC.size + _BODY.size:
+        return None
+    (crc,) = _CRC.unpack_from(header)
+    timestamp, flags, entity_len, project_len = _BODY.unpack_from(header, _CRC.size)
+    strings = stream.read(entity_len + project_len)
+    if len(strings) < entity_len + project_len:
+        return None
+    category = b""
+    if flags & _FLAG_CATEGORY:
+        length = stream.read(_CATEGORY_LENGTH.size)
+        if len(length) < _CATEGORY_LENGTH.size:
+            return None
+        (category_len,) = _CATEGORY_LENGTH.unpack(length)
+        category = stream.read(category_len)
+        if len(category) < category_len:
+            return None
+        strings += length + category
+    settings = None
+    if flags & _FLAG_SETTINGS:
+        read = _read_settings(stream)
+        if read is None:
+            return None
+        raw, settings = read
+        strings += raw
+    if zlib.crc32(header[_CRC.size :] + strings) != crc:
+        return None
+    return (
+        strings[:entity_len].decode("utf-8"),
+        strings[entity_len : entity_len + project_len].decode("utf-8"),
+        timestamp,
+        bool(flags & _FLAG_WRITE),
+        category.decode("utf-8"),
+        bool(flags & _FLAG_EXPLICIT_PROJECT),
+        settings,
+    )
+
+
+def _list_segments(directory: str) -> List[int]:
+    segments = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == _SEGMENT_SUFFIX and stem.isdigit():
+            segments.append(int(stem))
+    return sorted(segments)
+
+
+def _segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, f"{segment:016d}{_SEGMENT_SUFFIX}")
+
+
+def _read_cursor(directory: str, segments: List[int]) -> SpoolPosition:
+    try:
+        with open(os.path.join(directory, _CURSOR_FILE), "rb") as inp:
+            return SpoolPosition(*_CURSOR.unpack(inp.read(_CURSOR.size)))
+    except (OSError, struct.error):
+        return SpoolPosition(segments[0] if segments else 0, 0)
+
+
+def _read_intact(path: str, start: int) -> bytes:
+    """The intact records of the segment from the offset on"""
+    try:
+        inp = open(path, "rb")
+    except FileNotFoundError:
+        return b""
+    with inp:
+        inp.seek(start)
+        end = start
+        while _read_record(inp) is not None:
+            end = inp.tell()
+        inp.seek(start)
+        return inp.read(end - start)
+
+
+def _try_lock(directory: str, create: bool = False):
+    """The locked lock file of the directory, None if another spool owns it"""
+    path = os.path.join(directory, _LOCK_FILE)
+    try:
+        lock = open(path, "ab" if create else "r+b")
+    except OSError:
+        # not a spool, or it is being removed
+        return None
+    try:
+        # the spool may have been merged and removed before it was locked
+        if lock_file(lock, blocking=False) and os.path.samestat(
+            os.fstat(lock.fileno()), os.stat(path)
+        ):
+            return lock
+    except OSError:
+        pass
+    lock.close()
+    return None
+
+
+class Spool:
+    """Append-only heartbeat spool.
+
+    Every spool owns a subdirectory of the spool directory, which it
+    keeps locked while it is open: only the owner appends records,
+    moves the cursor and removes segments there, so Blender instances
+    never send or remove each other's heartbeats. A new spool takes over
+    a subdirectory that is not locked anymore, or creates a new one.
+
+    Each session writes to a new segment, so a record torn by a crash
+    can only be at the end of a segment and is skipped on reading.
+    """
+
+    SEGMENT_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, directory: str) -> None:
+        self._root = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._dir, self._owner_lock = self._claim()
+        self._segments = _list_segments(self._dir)
+        self._cursor = _read_cursor(self._dir, self._segments)
+        # each session starts a new segment after everything already written
+        self._active = max(self._segments[-1:] + [self._cursor.segment]) + 1
+        self._writer = None
+        self._compact()
+
+    def _claim(self):
+        for name in sorted(os.listdir(self._root)):
+            path = os.path.join(self._root, name)
+            if os.path.isdir(path):
+                lock = _try_lock(path)
+                if lock is not None:
+                    return path, lock
+        while True:
+            path = tempfile.mkdtemp(prefix="spool-", dir=self._root)
+            # another spool may have claimed the new directory first
+            lock = _try_lock(path, create=True)
+            if lock is not None:
+                return path, lock
+
+    def adopt_orphans(self) -> int:
+        """Move the records of the spools that are not open anymore into
+        this one, which sends them; returns the number of spools adopted.
+
+        Records left by versions without subdirectories are adopted too."""
+        adopted = 0
+        for name in sorted(os.listdir(self._root)):
+            path = os.path.join(self._root, name)
+            if path == self._dir or not os.path.isdir(path):
+                continue
+            lock = _try_lock(path)
+            if lock is not None:
+                self._merge(path, lock)
+                adopted += 1
+        if _list_segments(self._root):
+            lock = _try_lock(self._root, create=True)
+            if lock is not None:
+                self._merge(self._root, lock)
+                adopted += 1
+        return adopted
+
+    def _merge(self, directory: str, lock) -> None:
+        try:
+            segments = _list_segments(directory)
+            cursor = _read_cursor(directory, segments)
+            with self._lock:
+                for segment in segments:
+                    if segment >= cursor.segment:
+                        start = cursor.offset if segment == cursor.segment else 0
+                        data = _read_intact(_segment_path(directory, segment), start)
+                        if data:
+                            self._write(data)
+        except OSError:
+            # the records stay where they are, for a later attempt
+            lock.close()
+            raise
+        for segment in segments:
+            _remove(_segment_path(directory, segment))
+        _remove(os.path.join(directory, _CURSOR_FILE))
+        lock_path = os.path.join(directory, _LOCK_FILE)
+        # the lock file is removed while it is locked, where that is possible
+        _remove(lock_path)
+        lock.close()
+        _remove(lock_path)
+        if directory != self._root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def _compact(self) -> None:
+        """Remove the segments that precede the cursor."""
+        while self._segments and self._segments[0] < self._cursor.segment:
+            _remove(_segment_path(self._dir, self._segments[0]))
+            self._segments.pop(0)
+
+    def _write_cursor(self, position: SpoolPosition) -> None:
+        path = os.path.join(self._dir, _CURSOR_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(_CURSOR.pack(*position))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+
+    def _write(self, data: bytes) -> None:
+        """Write and fsync the data; the lock has to be held"""
+        if self._writer is None:
+            self._writer = open(_segment_path(self._dir, self._active), "ab")
+            if self._active not in self._segments:
+                self._segments.append(self._active)
+        self._writer.write(data)
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        if self._writer.tell() >= self.SEGMENT_SIZE:
+            self._writer.close()
+            self._writer = None
+            self._active += 1
+
+    def append(self, heartbeats: Iterable) -> None:
+        """Write the heartbeats and fsync them once for the whole batch."""
+        data = b"".join(encode(heartbeat) for heartbeat in heartbeats)
+        with self._lock:
+            self._write(data)
+
+    def pending(self) -> Iterator[Tuple[Record, SpoolPosition]]:
+        """Lazily read not yet acknowledged records with their end positions."""
+        with self._lock:
+            cursor = self._cursor
+            segments = [s for s in self._segments if s >= cursor.segment]
+        for segment in segments:
+            try:
+                inp = open(_segment_path(self._dir, segment), "rb")
+            except FileNotFoundError:
+                continue
+            with inp:
+                if segment == cursor.segment:
+                    inp.seek(cursor.offset)
+                while True:
+                    record = _read_record(inp)
+                    if record is None:
+                        break
+                    yield record, SpoolPosition(segment, inp.tell())
+
+    def ack(self, position: SpoolPosition) -> None:
+        """Mark everything up to the position as sent."""
+        with self._lock:
+            self._cursor = position
+            self._write_cursor(position)
+            self._compact()
+
+    def close(self) -> None:
+        """Close the spool, which may be adopted by another one afterwards"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._owner_lock.close()
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,143 @@
+import os
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, List
+
+import bpy
+from . import settings
+from .activity import gate
+
+STATS_FILE = os.path.join(settings.RESOURCES_DIR, "blender-stats.json")
+
+
+class Histogram:
+    """Counts of values that fall into fixed buckets"""
+
+    def __init__(self, bounds: List[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def as_dict(self) -> dict:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        count = sum(self.counts)
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": count,
+            "mean": self.total / count if count else 0,
+        }
+
+
+class Stats:
+    """Cheap counters of what the add-on costs in the running session.
+
+    The counters are plain attributes updated without locking; being
+    off by one in a race is fine, and nothing is aggregated until
+    a snapshot is requested.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.activity_calls = 0
+        self.activity_ns = 0
+        self.heartbeats_enqueued = 0
+        self.client_spawns = 0
+        self.send_latency_ms = Histogram([10, 20, 50, 100, 200, 500, 1000, 5000])
+        self.return_codes: Counter = Counter()
+        # name -> callable returning the current values of something
+        self._sources: Dict[str, Callable[[], dict]] = {}
+
+    def add_source(self, name: str, source: Callable[[], dict]) -> None:
+        self._sources[name] = source
+
+    def snapshot(self, handler_calls: int) -> dict:
+        snapshot = {
+            "uptime_s": time.time() - self.started,
+            "handler_calls": handler_calls,
+            "activity_calls": self.activity_calls,
+            "activity_ms": self.activity_ns / 1e6,
+            "heartbeats_enqueued": self.heartbeats_enqueued,
+            "client_spawns": self.client_spawns,
+            "send_latency_ms": self.send_latency_ms.as_dict(),
+            "return_codes": {str(k): v for k, v in self.return_codes.items()},
+        }
+        for name, source in self._sources.items():
+            snapshot[name] = source()
+        return snapshot
+
+
+stats = Stats()
+
+
+def _snapshot() -> dict:
+    return stats.snapshot(gate.events)
+
+
+class ExportStats(bpy.types.Operator):
+    bl_idname = "ui.wakatime_blender_export_stats"
+    bl_label = "Export Wakatime Statistics"
+    bl_description = f"Save the add-on performance counters to {STATS_FILE}"
+
+    def execute(self, _context):
+        import json
+
+        try:
+            with open(STATS_FILE, "w") as out:
+                json.dump(_snapshot(), out, indent=2)
+        except OSError as e:
+            self.report({"ERROR"}, f"Unable to write {STATS_FILE}: {e}")
+            return {"CANCELLED"}
+        self.report({"INFO"}, f"Saved {STATS_FILE}")
+        return {"FINISHED"}
+
+
+class StatsDialog(bpy.types.Operator):
+    bl_idname = "ui.wakatime_blender_stats"
+    bl_label = "Wakatime Statistics"
+    bl_description = "Show what the wakatime plugin costs in this session"
+
+    def execute(self, _context):
+        return {"FINISHED"}
+
+    def invoke(self, context, _event):
+        return context.window_manager.invoke_popup(self, width=400)
+
+    def draw(self, _context):
+        snapshot = _snapshot()
+        col = self.layout.column()
+        col.label(text=f"Handler calls: {snapshot['handler_calls']}")
+        col.label(
+            text=f"Handled activity: {snapshot['activity_calls']} times, "
+            f"{snapshot['activity_ms']:.1f} ms in total"
+        )
+        col.label(text=f"Heartbeats enqueued: {snapshot['heartbeats_enqueued']}")
+        buffer = snapshot.get("buffer")
+        if buffer:
+            col.label(
+                text=f"Queue depth: {buffer['depth']}, merged: {buffer['merged']}, "
+                f"dropped: {buffer['dropped']}, spilled: {buffer['spilled']}"
+            )
+        retry = snapshot.get("retry")
+        if retry and (retry["failures"] or retry["paused_for_api_key"]):
+            state = "paused for a new API key"
+            if not retry["paused_for_api_key"]:
+                state = f"next attempt in {retry['next_attempt_s']} s"
+                if retry["circuit_open"]:
+                    state = f"API unreachable, {state}"
+            col.label(text=f"Failed sends in a row: {retry['failures']}, {state}")
+        col.label(text=f"Client spawns: {snapshot['client_spawns']}")
+        latency = snapshot["send_latency_ms"]
+        col.label(
+            text=f"Sends: {latency['count']}, mean latency {latency['mean']:.0f} ms"
+        )
+        for bucket, count in latency["buckets"].items():
+            if count:
+                col.label(text=f"    {bucket} ms: {count}")
+        codes = ", ".join(f"{k}: {v}" for k, v in snapshot["return_codes"].items())
+        col.label(text=f"Return codes: {codes or '-'}")
+        col.operator(ExportStats.bl_idname)
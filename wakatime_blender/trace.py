@@ -0,0 +1,175 @@
+"""Recordings of the handler events of a session, for offline load testing.
+
+A trace starts with MAGIC and the wall-clock time of the recording start.
+Each event is a kind byte and the time since the previous event in
+microseconds; the filepath is only written when it changes, as a PATH
+record that applies to all the events after it. At 240 depsgraph
+updates per second an hour of activity takes about 4 MiB.
+
+The traces are replayed by benchmarks/replay.py.
+"""
+import os
+import struct
+import time
+from typing import Iterator, NamedTuple, Optional
+
+import bpy
+from bpy.app.handlers import persistent
+from . import settings
+from .log import INFO, log
+
+MAGIC = b"WKTRACE1"
+TRACE_DIR = os.path.join(settings.RESOURCES_DIR, "blender-traces")
+
+PATH = 0
+LOAD_POST = 1
+SAVE_POST = 2
+DEPSGRAPH_UPDATE_PRE = 3
+
+_START = struct.Struct("<d")
+_EVENT = struct.Struct("<BI")
+_PATH_LENGTH = struct.Struct("<H")
+# longer pauses are shortened, nothing is sent while idle anyway
+_MAX_DELTA = 2**32 - 1
+
+
+class TraceEvent(NamedTuple):
+    # wall-clock time
+    time: float
+    kind: int
+    filepath: str
+
+
+class TraceWriter:
+    """Buffers the events and writes them in large chunks"""
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path: str, start: Optional[float] = None) -> None:
+        self.path = path
+        self._out = open(path, "wb")
+        self._buffer = bytearray(MAGIC)
+        self._buffer += _START.pack(time.time() if start is None else start)
+        self._last = time.monotonic() if start is None else start
+        self._filepath: Optional[str] = None
+        self.events = 0
+
+    def record(self, kind: int, filepath: str, now: Optional[float] = None) -> None:
+        """Add an event; now is taken from the monotonic clock by default"""
+        now = time.monotonic() if now is None else now
+        if filepath != self._filepath:
+            self._filepath = filepath
+            encoded = filepath.encode("utf-8")
+            self._buffer += _EVENT.pack(PATH, 0)
+            self._buffer += _PATH_LENGTH.pack(len(encoded)) + encoded
+        delta = min(max(round((now - self._last) * 1e6), 0), _MAX_DELTA)
+        self._last = now
+        self._buffer += _EVENT.pack(kind, delta)
+        self.events += 1
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        self._out.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._out.close()
+
+
+def read_trace(path: str) -> Iterator[TraceEvent]:
+    with open(path, "rb") as inp:
+        if inp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a wakatime trace")
+        (now,) = _START.unpack(inp.read(_START.size))
+        filepath = ""
+        while True:
+            data = inp.read(_EVENT.size)
+            if len(data) < _EVENT.size:
+                return
+            kind, delta = _EVENT.unpack(data)
+            if kind == PATH:
+                (length,) = _PATH_LENGTH.unpack(inp.read(_PATH_LENGTH.size))
+                filepath = inp.read(length).decode("utf-8")
+                continue
+            now += delta / 1e6
+            yield TraceEvent(now, kind, filepath)
+
+
+_writer: Optional[TraceWriter] = None
+
+
+@persistent
+def _record_load(_):
+    _writer.record(LOAD_POST, bpy.data.filepath)
+
+
+@persistent
+def _record_save(_):
+    _writer.record(SAVE_POST, bpy.data.filepath)
+
+
+@persistent
+def _record_activity(_):
+    _writer.record(DEPSGRAPH_UPDATE_PRE, bpy.data.filepath)
+
+
+_HANDLERS = (
+    ("load_post", _record_load),
+    ("save_post", _record_save),
+    ("depsgraph_update_pre", _record_activity),
+)
+
+
+def recording() -> bool:
+    return _writer is not None
+
+
+def start_recording() -> str:
+    """Record the events until stop_recording, returns the trace path.
+
+    The recording handlers are only installed while recording,
+    so the recorder costs nothing otherwise."""
+    global _writer
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.trace")
+    _writer = TraceWriter(path)
+    for name, handler in _HANDLERS:
+        getattr(bpy.app.handlers, name).append(handler)
+    log(INFO, "Recording activity trace to {}", path)
+    return path
+
+
+def stop_recording() -> None:
+    global _writer
+    if _writer is None:
+        return
+    for name, handler in _HANDLERS:
+        getattr(bpy.app.handlers, name).remove(handler)
+    writer, _writer = _writer, None
+    writer.close()
+    log(INFO, "Recorded {} events to {}", writer.events, writer.path)
+
+
+class ToggleTraceRecording(bpy.types.Operator):
+    bl_idname = "ui.wakatime_blender_trace"
+    bl_label = "Start/Stop Wakatime Trace Recording"
+    bl_description = (
+        f"Record the activity events of this session to {TRACE_DIR} "
+        "for load testing with benchmarks/replay.py"
+    )
+
+    def execute(self, _context):
+        if recording():
+            path = _writer.path
+            stop_recording()
+            self.report({"INFO"}, f"Saved the activity trace to {path}")
+            return {"FINISHED"}
+        try:
+            path = start_recording()
+        except OSError as e:
+            self.report({"ERROR"}, f"Unable to record the activity trace: {e}")
+            return {"CANCELLED"}
+        self.report({"INFO"}, f"Recording the activity trace to {path}")
+        return {"FINISHED"}
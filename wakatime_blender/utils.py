@@ -1,4 +1,6 @@
+import os
 import sys
+import time
 
 
 def u(text):
@@ -16,3 +18,31 @@ def u(text):
         return str(text)
     except Exception:
         return text
+
+
+def lock_file(file, blocking: bool = True) -> bool:
+    """Lock the open file for this process; the lock is released when the
+    file is closed. Returns False if another process holds the lock
+    and blocking is False."""
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            file.seek(0)
+            while True:
+                try:
+                    # the first byte is locked, even if the file is empty
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        raise
+                    time.sleep(0.1)
+        else:
+            import fcntl
+
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(file.fileno(), flags)
+    except OSError:
+        return False
+    return True
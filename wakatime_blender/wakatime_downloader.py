@@ -1,43 +1,48 @@
 import os
 import shutil
-import ssl
+import sys
 import threading
-import urllib
-import urllib.error
-import urllib.request
-from time import sleep
+from time import monotonic, sleep, strftime
 from typing import NamedTuple, Optional, Tuple
-from zipfile import ZipFile
 
 import bpy
 from . import settings
-from .log import ERROR, INFO, log
+from .log import ERROR, INFO, level_name, log
 from .preferences import WakatimeProjectProperties
+from .utils import lock_file, u
 
 ReportArgs = Tuple[set, str]
 
 
 class Status(NamedTuple):
     message: str
-    level: str = INFO
+    level: int = INFO
 
     def as_report(self) -> ReportArgs:
-        return {self.level or INFO}, self.message
+        return {level_name(self.level)}, self.message
+
+
+def _size(num_bytes: float) -> str:
+    return f"{num_bytes / 1024 / 1024:.1f} MiB"
 
 
 class WakatimeDownloader(threading.Thread):
     """Downloads Wakatime client if it isn't already downloaded."""
 
     _lock = threading.Lock()
+    CHUNK_SIZE = 64 * 1024
+    # how often to report download progress, seconds
+    PROGRESS_INTERVAL = 1
 
-    def __init__(self, force=False) -> None:
+    def __init__(self, force=False, url: str = settings.API_CLIENT_URL) -> None:
         super().__init__()
         self.daemon = True
         self._force = force
+        self._url = url
         self._status_lock = threading.Lock()
         self._status: Optional[Status] = None
 
-    def _set_status(self, message: str, level: str = INFO) -> None:
+    def _set_status(self, message: str, level: int = INFO) -> None:
         with self._status_lock:
             self._status = Status(message, level)
         log(level, message)
@@ -47,6 +52,254 @@ class WakatimeDownloader(threading.Thread):
         with self._status_lock:
             return self._status.as_report() if self._status else None
 
+    def _download(self, zip_file_path: str) -> None:
+        """Stream the archive to disk, resuming an interrupted download.
+
+        The data is written to a .part file, which is renamed only when
+        the download is complete, so an interrupted download is continued
+        with a Range request the next time."""
+        # the network modules are only imported when they are needed,
+        # they take a noticeable part of Blender startup otherwise
+        import http.client
+        import ssl
+        import urllib.error
+        import urllib.request
+
+        part_path = f"{zip_file_path}.part"
+        downloaded = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        # issue a new request to download said client
+        req = urllib.request.Request(self._url)
+        if downloaded:
+            req.add_header("Range", f"bytes={downloaded}-")
+        context = ssl._create_unverified_context()
+        try:
+            r = urllib.request.urlopen(req, context=context)
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not downloaded:
+                raise
+            # the range is not satisfiable, so the partial download
+            # is either complete or broken; start from scratch
+            os.remove(part_path)
+            return self._download(zip_file_path)
+        with r:
+            if downloaded and r.status != 206:
+                # the server ignored the Range header
+                downloaded = 0
+            length = r.headers.get("Content-Length")
+            total = downloaded + int(length) if length else 0
+            with open(part_path, "ab" if downloaded else "wb") as fo:
+                last_report = monotonic()
+                while True:
+                    try:
+                        chunk = r.read(self.CHUNK_SIZE)
+                    except (OSError, http.client.HTTPException) as e:
+                        raise urllib.error.URLError(
+                            f"Download interrupted at {_size(downloaded)}: {e}"
+                        )
+                    if not chunk:
+                        break
+                    fo.write(chunk)
+                    downloaded += len(chunk)
+                    if monotonic() - last_report >= self.PROGRESS_INTERVAL:
+                        last_report = monotonic()
+                        self._report_progress(downloaded, total)
+        if total and downloaded < total:
+            raise urllib.error.URLError(
+                f"Download interrupted at {_size(downloaded)} of {_size(total)}"
+            )
+        os.replace(part_path, zip_file_path)
+
+    def _report_progress(self, downloaded: int, total: int) -> None:
+        if total:
+            self._set_status(
+                f"Downloading Wakatime... {downloaded * 100 // total}% "
+                f"({_size(downloaded)} of {_size(total)})"
+            )
+        else:
+            self._set_status(f"Downloading Wakatime... {_size(downloaded)}")
+
+    @staticmethod
+    def _extract(zip_file_path: str, runtime_dir: str) -> bool:
+        """Extract only the wakatime package from the repository archive"""
+        cli = os.path.join(runtime_dir, settings.API_CLIENT_RELPATH)
+        package_dir = os.path.dirname(cli)
+        cli_name = os.path.basename(cli)
+        from zipfile import ZipFile
+
+        with ZipFile(zip_file_path) as zf:
+            names = zf.namelist()
+            suffix = f"/wakatime/{cli_name}"
+            cli_path = next((n for n in names if n.endswith(suffix)), None)
+            if cli_path is None:
+                return False
+            prefix = cli_path[: -len(cli_name)]
+            for name in names:
+                if not name.startswith(prefix) or name.endswith("/"):
+                    continue
+                parts = name[len(prefix) :].split("/")
+                if ".." in parts:
+                    continue
+                target = os.path.join(package_dir, *parts)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with zf.open(name) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+        return True
+
+    @staticmethod
+    def _test_import(runtime_dir: str) -> bool:
+        """Check that the extracted client can be imported by Blender's python"""
+        import subprocess
+
+        cli = os.path.join(runtime_dir, settings.API_CLIENT_RELPATH)
+        try:
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys; sys.path.insert(0, sys.argv[1]); import wakatime",
+                    os.path.dirname(os.path.dirname(cli)),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=60,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            log(ERROR, "Unable to test the Wakatime client: {}", e)
+            return False
+        if result.returncode:
+            log(ERROR, "Unable to import the Wakatime client: {}", u(result.stdout))
+        return result.returncode == 0
+
+    @staticmethod
+    def _compile(runtime_dir: str) -> Optional[float]:
+        """Bytecode-compile the client for Blender's python.
+
+        Returns the time it took, or None if compilation failed,
+        e.g. because the directory is read-only."""
+        import compileall
+
+        start = monotonic()
+        package_dir = os.path.dirname(
+            os.path.join(runtime_dir, settings.API_CLIENT_RELPATH)
+        )
+        if not compileall.compile_dir(package_dir, quiet=2):
+            return None
+        return monotonic() - start
+
+    @staticmethod
+    def _prewarm(cli: str) -> Optional[float]:
+        """Run the client once, so that the first heartbeat does not pay
+        for the cold disk cache. Returns the time it took, or None on errors."""
+        import subprocess
+
+        start = monotonic()
+        try:
+            result = subprocess.run(
+                [sys.executable, cli, "--version"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=60,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            log(ERROR, "Unable to run the Wakatime client: {}", e)
+            return None
+        if result.returncode:
+            log(ERROR, "Wakatime client failed: {}", u(result.stdout))
+            return None
+        return monotonic() - start
+
+    def _warm_up(self, runtime_dir: str) -> str:
+        """Compile and prewarm the client, returns the timings for the status"""
+        self._set_status("Compiling Wakatime...")
+        compiled = self._compile(runtime_dir)
+        self._set_status("Prewarming Wakatime...")
+        cli = os.path.join(runtime_dir, settings.API_CLIENT_RELPATH)
+        prewarmed = self._prewarm(cli)
+        return ", ".join(
+            f"{step} in {seconds:.2f} s" if seconds is not None else f"not {step}"
+            for step, seconds in (("compiled", compiled), ("prewarmed", prewarmed))
+        )
+
+    def _install(self, zip_file_path: str) -> Optional[str]:
+        """Stage the client next to the active one, verify it and switch to it.
+
+        Heartbeats are sent by the active version all the while,
+        so the installation causes no downtime.
+        Returns the timings of the warm up, or None if installation failed.
+        The archive is removed by the caller in any case."""
+        from zipfile import BadZipFile, ZipFile
+
+        self._set_status("Verifying Wakatime...")
+        try:
+            with ZipFile(zip_file_path) as zf:
+                corrupted = zf.testzip()
+        except (BadZipFile, OSError) as e:
+            corrupted = e
+        if corrupted is not None:
+            # e.g. a resumed download that did not continue the first part;
+            # the next attempt downloads the archive from scratch
+            self._remove_partial_download(zip_file_path)
+            self._set_status(
+                f"The downloaded archive is corrupted: {corrupted}",
+                ERROR,
+            )
+            return None
+        version = f"{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        version_dir = os.path.join(settings.API_CLIENT_VERSIONS_DIR, version)
+        staging_dir = f"{version_dir}.staging"
+        self._set_status("Extracting Wakatime...")
+        try:
+            extracted = self._extract(zip_file_path, staging_dir)
+        except (BadZipFile, OSError) as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self._set_status(f"Unable to extract the Wakatime client: {e}", ERROR)
+            return None
+        if not extracted:
+            self._set_status(
+                "The downloaded archive does not contain the Wakatime client",
+                ERROR,
+            )
+            return None
+        if not self._test_import(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self._set_status("The downloaded Wakatime client is broken", ERROR)
+            return None
+        try:
+            os.rename(staging_dir, version_dir)
+        except OSError as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self._set_status(f"Unable to install the Wakatime client: {e}", ERROR)
+            return None
+        timings = self._warm_up(version_dir)
+        previous = settings.active_api_client_version()
+        settings.activate_api_client_version(version)
+        self._collect_garbage({version, previous})
+        return timings
+
+    @staticmethod
+    def _remove_partial_download(zip_file_path: str) -> None:
+        try:
+            os.remove(f"{zip_file_path}.part")
+        except OSError:
+            pass
+
+    def _collect_garbage(self, keep: set) -> None:
+        """Remove client versions except the given ones, and the unversioned client.
+
+        The previous version is kept, because a client process may still use it.
+        Other Blender instances do not install versions meanwhile, as the
+        caller holds API_CLIENT_LOCK, so staging directories are left over
+        from interrupted installations."""
+        for name in os.listdir(settings.API_CLIENT_VERSIONS_DIR):
+            if name not in keep:
+                shutil.rmtree(
+                    os.path.join(settings.API_CLIENT_VERSIONS_DIR, name),
+                    ignore_errors=True,
+                )
+        if os.path.isdir(settings.API_CLIENT_DIR):
+            self._set_status("Removing old runtime...")
+            shutil.rmtree(settings.API_CLIENT_DIR, ignore_errors=True)
+
     def run(self):
         with self._lock:
             if not os.path.isdir(settings.RESOURCES_DIR):
@@ -60,55 +313,56 @@ class WakatimeDownloader(threading.Thread):
                         ERROR,
                     )
                     return
-            # check if the client is already downloaded,
-            # or the downloading is forced
-            if not self._force and os.path.isfile(settings.API_CLIENT):
-                self._set_status("Found Wakatime client")
-                return
-            if os.path.isdir(settings.API_CLIENT_DIR):
-                # remove wakatime client dir if it is present
-                self._set_status("Removing old runtime...")
-                shutil.rmtree(settings.API_CLIENT_DIR, ignore_errors=True)
-            # there is no Wakatime client present in the directory,
-            # or the downloading is forced
-            self._set_status("Downloading Wakatime...")
-            # the path to the zipped Wakatime client
-            zip_file_path = os.path.join(settings.RESOURCES_DIR, "wakatime-master.zip")
-            # issue a new request to download said client
-            req = urllib.request.Request(settings.API_CLIENT_URL)
-            context = ssl._create_unverified_context()
-            try:
-                # read and save the file to said zip file
-                with urllib.request.urlopen(req, context=context) as r, open(
-                    zip_file_path, "wb+"
-                ) as fo:
-                    # as the input file is in bytes, the write mode has
-                    # to be bytes as well, that's why it's `wb+`
-                    fo.write(r.read())
-            except urllib.error.HTTPError as e:
-                self._set_status(
-                    "Could not download the Wakatime client. There was an HTTP error.",
-                    ERROR,
-                )
-                raise e
-            except urllib.error.URLError as e:
-                self._set_status(
-                    "Could not download the Wakatime client. There was a URL error. "
-                    "Maybe there is a problem with your Internet connection?",
-                    ERROR,
-                )
-                raise e
-            self._set_status("Extracting Wakatime...")
-            with ZipFile(zip_file_path) as zf:
-                zf.extractall(settings.API_CLIENT_DIR)
-            try:
-                os.remove(zip_file_path)
-            except Exception:
-                self._set_status(
-                    "Unable to remove wakatime archive",
-                    ERROR,
-                )
-            self._set_status("Wakatime client downloaded")
+            # other Blender instances install into the same directories
+            with open(settings.API_CLIENT_LOCK, "a") as lock:
+                if not lock_file(lock, blocking=False):
+                    self._set_status(
+                        "Waiting for another Blender instance to install Wakatime..."
+                    )
+                    lock_file(lock)
+                self._ensure_client()
+
+    def _ensure_client(self) -> None:
+        import urllib.error
+
+        # check if the client is already downloaded,
+        # or the downloading is forced
+        client = settings.api_client()
+        if not self._force and os.path.isfile(client):
+            runtime_dir = client[: -len(settings.API_CLIENT_RELPATH)]
+            timings = self._warm_up(runtime_dir)
+            self._set_status(f"Found Wakatime client ({timings})")
+            return
+        # there is no Wakatime client present in the directory,
+        # or the downloading is forced
+        self._set_status("Downloading Wakatime...")
+        # the path to the zipped Wakatime client
+        zip_file_path = os.path.join(settings.RESOURCES_DIR, "wakatime-master.zip")
+        try:
+            self._download(zip_file_path)
+        except urllib.error.HTTPError as e:
+            self._set_status(
+                "Could not download the Wakatime client. There was an HTTP error.",
+                ERROR,
+            )
+            raise e
+        except urllib.error.URLError as e:
+            self._set_status(
+                "Could not download the Wakatime client. There was a URL error. "
+                "Maybe there is a problem with your Internet connection?",
+                ERROR,
+            )
+            raise e
+        timings = self._install(zip_file_path)
+        try:
+            os.remove(zip_file_path)
+        except Exception:
+            self._set_status(
+                "Unable to remove wakatime archive",
+                ERROR,
+            )
+        if timings is not None:
+            self._set_status(f"Wakatime client installed ({timings})")
 
 
 class ForceWakatimeDownload(bpy.types.Operator):